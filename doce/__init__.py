@@ -2,5 +2,11 @@ from doce.experiment import Experiment
 from doce.metric import Metric
 from doce.plan import Plan
 from doce.setting import Setting
+from doce.ledger import Ledger
+from doce.profiler import Profiler
+from doce.tracer import Tracer
+from doce.monitor import Monitor
+from doce.manifest import Manifest
+from doce.summary import Summary
 import doce.util
 import doce.cli
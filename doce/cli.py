@@ -72,6 +72,16 @@ def main(experiment = None, func = None, display_func = None):
       nargs='?',
       const=1
   )
+  parser.add_argument(
+      '--backend',
+      type=str,
+      help=r'backend used to compute settings in parallel with -c, \
+      and to reduce settings in parallel with --reduce_jobs: \
+      thread (default) or process. Processes scale with the number of cores \
+      for steps bound by Python computations.',
+      choices=['thread', 'process'],
+      default='thread'
+  )
   parser.add_argument(
       '-C',
       '--copy',
@@ -164,6 +174,31 @@ def main(experiment = None, func = None, display_func = None):
       help=r'list settings.',
       action='store_true'
   )
+  parser.add_argument(
+      '-L',
+      '--ledger',
+      type=str,
+      help=r'record the wall time, CPU time, peak memory and I/O of each computed setting \
+      in the given JSON lines file (default to the experiment name followed by _ledger.jsonl \
+      in the code path).',
+      nargs='?',
+      const=''
+  )
+  parser.add_argument(
+      '--ledger_report',
+      type=int,
+      help=r'report the given number (default 10) of slowest and most memory hungry settings \
+      recorded in the ledger, and the resources used by the settings of each modality.',
+      nargs='?',
+      const=10,
+      default=0
+  )
+  parser.add_argument(
+      '--missing',
+      help=r'list the selected settings whose outputs required by the metrics are not available, \
+      with the missing outputs.',
+      action='store_true'
+  )
   parser.add_argument(
       '-M',
       '--mail',
@@ -174,6 +209,22 @@ def main(experiment = None, func = None, display_func = None):
       default='-1'
   )
 
+  parser.add_argument(
+      '--metrics_port',
+      type=int,
+      help=r'during the computation, serve the progress metrics (settings done, failed, \
+      skipped and in flight, throughput, ETA and worker utilization) in the Prometheus \
+      text format on http://127.0.0.1:METRICS_PORT/metrics.',
+      default=None
+  )
+  parser.add_argument(
+      '--metrics_file',
+      type=str,
+      help=r'during the computation, write the progress metrics in the Prometheus \
+      text format to the given file every 5 seconds, for instance for the textfile \
+      collector of a node exporter.',
+      default=''
+  )
   parser.add_argument(
       '-o',
       '--order',
@@ -190,6 +241,26 @@ def main(experiment = None, func = None, display_func = None):
       help=r'show the active plan of the experiment.',
       action='store_true'
   )
+  parser.add_argument(
+      '--profile',
+      type=str,
+      help=r'profile the computation of each setting with cProfile, store the statistics \
+      of each setting in the given directory (default to the experiment name followed by _profile \
+      in the code path) and report the functions of highest cost over the selected settings.',
+      nargs='?',
+      const=''
+  )
+  parser.add_argument(
+      '--profile_rate',
+      type=float,
+      help=r'probability for a setting to be profiled with --profile (default 1).',
+      default=1.
+  )
+  parser.add_argument(
+      '--profile_memory',
+      help=r'also trace the memory allocations of each setting with tracemalloc when profiling.',
+      action='store_true'
+  )
   parser.add_argument(
       '-P',
       '--progress',
@@ -199,6 +270,21 @@ def main(experiment = None, func = None, display_func = None):
       nargs='?',
       const='d'
   )
+  parser.add_argument(
+      '--reduce_cache',
+      help=r'with -d, reuse the values cached beside the data sink for the outputs unchanged \
+      since the previous display. Modifications of the functions called through a module \
+      by the reduction functions are not tracked.',
+      action='store_true'
+  )
+  parser.add_argument(
+      '--reduce_jobs',
+      type=int,
+      help=r'number of settings reduced in parallel with -d (default 1). \
+      The reads of the outputs overlap, which speeds up the display on network file systems. \
+      Reduction functions bound by Python computations benefit from --backend process.',
+      default=1
+  )
   parser.add_argument(
       '-R',
       '--remove',
@@ -217,12 +303,37 @@ def main(experiment = None, func = None, display_func = None):
       help=r'selection of plan and settings, for example plan_name/factor1=modality2+factor4=modality1',
       default='[]'
   )
+  parser.add_argument(
+      '--shard',
+      type=str,
+      help=r'only consider one shard of the selected settings, specified as index/count, \
+      for example 0/4 for the first of 4 disjoint shards. Each shard is a contiguous slice \
+      of the selected settings, so that several processes or nodes can share the computation.',
+      default=''
+  )
+  parser.add_argument(
+      '--schedule',
+      help=r'compute first the settings with the longest expected duration, \
+      estimated from the durations recorded in the ledger (see -L), \
+      so that long settings do not leave parallel jobs idle at the end of the computation. \
+      The order of the plan is kept if the ledger is empty or missing.',
+      action='store_true'
+  )
   parser.add_argument(
       '-S',
       '--skip',
       help=r'check availability of any metric of a given setting and skip \
       computation if available.',
       action='store_true')
+  parser.add_argument(
+      '--trace',
+      type=str,
+      help=r'record the timeline of the computation and of the reduction in the given JSON file \
+      (default to the experiment name followed by _trace.json in the code path) \
+      with the Chrome trace event format, viewable with chrome://tracing or Perfetto.',
+      nargs='?',
+      const=''
+  )
   parser.add_argument(
       '-u',
       '--user_data',
@@ -307,10 +418,23 @@ def main(experiment = None, func = None, display_func = None):
   else:
     plan_order_factor = None
   experiment.select(selector, show=args.plan, plan_order_factor=plan_order_factor)
+  if args.shard:
+    shard_index, shard_count = args.shard.split('/')
+    experiment._plan.shard(int(shard_index), int(shard_count))
 
   if args.information:
     print(experiment)
 
+  ledger_file_name = args.ledger
+  if not ledger_file_name:
+    ledger_file_name = os.path.join(experiment.path.code, f'{experiment.name}_ledger.jsonl')
+  if args.schedule:
+    ledger = doce.Ledger(ledger_file_name)
+    if ledger.entries():
+      experiment._plan.schedule(ledger.cost())
+    else:
+      print(f'No entry in the ledger {ledger_file_name}, the settings are computed in the order of the plan.')
+
   if args.list:
     experiment.perform(
         experiment.selector,
@@ -366,6 +490,10 @@ def main(experiment = None, func = None, display_func = None):
     else:
       print('Up are the commands available.\nPlease inspect scripts files available in the jobs directory.\nIf correct please add -c or --compute to the command line for launching the jobs.')
     exit()
+  if args.missing:
+    for identifier, outputs in experiment.missing_outputs(experiment.selector).items():
+      print(f'{identifier}: {", ".join(outputs)}')
+
   if args.files:
     experiment.perform(
         experiment.selector,
@@ -439,6 +567,23 @@ def main(experiment = None, func = None, display_func = None):
       f'{args.select} has started.',
       f'<div> Selector = {args.select}</div>'
       )
+  profiler = None
+  if args.profile is not None:
+    profile_path = args.profile
+    if not profile_path:
+      profile_path = os.path.join(experiment.path.code, f'{experiment.name}_profile')
+    profiler = doce.Profiler(profile_path, rate=args.profile_rate, memory=args.profile_memory)
+  monitor = None
+  if args.metrics_port is not None or args.metrics_file:
+    monitor = doce.Monitor(port=args.metrics_port, file_name=args.metrics_file)
+  # the settings listed by -l, -f or -j are not recorded in the ledger nor traced
+  if args.ledger is not None:
+    experiment.set_ledger(ledger_file_name)
+  if args.trace is not None:
+    trace_file_name = args.trace
+    if not trace_file_name:
+      trace_file_name = os.path.join(experiment.path.code, f'{experiment.name}_trace.json')
+    experiment.set_trace(trace_file_name)
   if args.compute and func:
     experiment.perform(
       experiment.selector,
@@ -446,8 +591,15 @@ def main(experiment = None, func = None, display_func = None):
       nb_jobs=args.compute,
       log_file_name=log_file_name,
       progress=args.progress,
-      mail_interval=float(args.mail)
+      mail_interval=float(args.mail),
+      backend=args.backend,
+      profile=profiler,
+      monitor=monitor
       )
+  if profiler:
+    print(profiler.report(plan=experiment._plan.select(experiment.selector)))
+  if args.ledger_report:
+    print(doce.Ledger(ledger_file_name).report(top=args.ledger_report))
 
   select_display = []
   select_factor = ''
@@ -494,6 +646,8 @@ def main(experiment = None, func = None, display_func = None):
           body += f'<h2> Error log </h2>{log_html}'
   if args.mail > -1:
     experiment.send_mail(f'{args.select} is over.', body)
+  if experiment._tracer:
+    experiment._tracer.export()
 
 
 def data_frame_display(experiment, args, select_display, select_factor):
@@ -509,21 +663,27 @@ def data_frame_display(experiment, args, select_display, select_factor):
     masked_selector_factor = selector[factor_index]
 
     selector[factor_index] = [0]
-    experiment._plan.select(selector).__set_settings__()
-    settings = experiment._plan._settings
+    settings = [list(setting._setting) for setting in experiment._plan.select(selector)]
 
     for setting in settings:
       setting[factor_index] = masked_selector_factor
 
-  (table, columns, header, nb_factor_columns, modification_time_stamp, significance) = experiment.metric.reduce(
-    experiment._plan.select(selector),
-    experiment.path,
-    factor_display=experiment._display.factor_format_in_reduce,
-    metric_display=experiment._display.metric_format_in_reduce,
-    factor_display_length=experiment._display.factor_format_in_reduce_length,
-    metric_display_length=experiment._display.metric_format_in_reduce_length,
-    verbose=args.verbose
-    )
+  # the data sinks are scanned once for all the reductions of the display
+  snapshots = {}
+  with experiment.trace('reduce', 'reduction'):
+    (table, columns, header, nb_factor_columns, modification_time_stamp, significance) = experiment.metric.reduce(
+      experiment._plan.select(selector),
+      experiment.path,
+      factor_display=experiment._display.factor_format_in_reduce,
+      metric_display=experiment._display.metric_format_in_reduce,
+      factor_display_length=experiment._display.factor_format_in_reduce_length,
+      metric_display_length=experiment._display.metric_format_in_reduce_length,
+      verbose=args.verbose,
+      nb_jobs=args.reduce_jobs,
+      backend=args.backend,
+      cache=args.reduce_cache,
+      snapshots=snapshots
+      )
 
   if len(table) == 0:
     return (None, '', None, None, None)
@@ -542,15 +702,20 @@ def data_frame_display(experiment, args, select_display, select_factor):
       table[row_index] = table[row_index][:nb_factor_columns]
     # print(settings)
     for setting_index, setting in enumerate(settings):
-      (setting_descriptions, _, _, _, setting_modification_time_stamp, setting_p_values) = experiment.metric.reduce(
-        experiment._plan.select(setting),
-        experiment.path,
-        factor_display=experiment._display.factor_format_in_reduce,
-        metric_display=experiment._display.metric_format_in_reduce,
-        factor_display_length=experiment._display.factor_format_in_reduce_length,
-        metric_display_length=experiment._display.metric_format_in_reduce_length,
-        verbose=args.verbose
-        )
+      with experiment.trace('reduce', 'reduction'):
+        (setting_descriptions, _, _, _, setting_modification_time_stamp, setting_p_values) = experiment.metric.reduce(
+          experiment._plan.select(setting),
+          experiment.path,
+          factor_display=experiment._display.factor_format_in_reduce,
+          metric_display=experiment._display.metric_format_in_reduce,
+          factor_display_length=experiment._display.factor_format_in_reduce_length,
+          metric_display_length=experiment._display.metric_format_in_reduce_length,
+          verbose=args.verbose,
+          nb_jobs=args.reduce_jobs,
+          backend=args.backend,
+          cache=args.reduce_cache,
+          snapshots=snapshots
+          )
       modification_time_stamp += setting_modification_time_stamp # ???
       significance[setting_index, :] = setting_p_values[:, select_display[0]]
       for setting_description in setting_descriptions:
@@ -595,7 +760,9 @@ def data_frame_display(experiment, args, select_display, select_factor):
   for column_index, column in enumerate(columns):
     # if data_frame[column].dtypes == 'bool':
     #   bool_selector.append(column) 
-    if np.sum(np.array(data_frame[column])==-99999)+np.sum(np.array(data_frame[column])==0)+np.sum(np.array(data_frame[column])==1) == np.array((data_frame[column])).size:
+    # inactive factors are None
+    nb_inactive = sum(value is None for value in data_frame[column])
+    if nb_inactive+np.sum(np.array(data_frame[column])==-99999)+np.sum(np.array(data_frame[column])==0)+np.sum(np.array(data_frame[column])==1) == np.array((data_frame[column])).size:
       bool_selector.append(column)
       data_frame[column] = data_frame[column].replace({-99999: 0})
       data_frame = data_frame.astype({column: 'bool'})
@@ -675,7 +842,7 @@ def int_bool(val):
   return val
 
 def remove_special(val):
-  if val == -99999 or val == '-99999':
+  if val is None or val == -99999 or val == '-99999':
     return ''
   return val
 
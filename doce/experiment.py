@@ -8,6 +8,7 @@ import datetime
 import ast
 import glob
 import copy
+import contextlib
 import numpy as np
 import doce.util as eu
 import doce
@@ -103,6 +104,10 @@ class Experiment():
     self._atrs = []
     self._plan = doce.Plan('test')
     self._plans = []
+    self._merged_plan = None
+    self._ledger = None
+    self._tracer = None
+    self._manifests = {}
     self.name = ''
     self.description = ''
     self.author = 'no name'
@@ -214,6 +219,95 @@ class Experiment():
           if not force:
             print('Path succesfully created.')
 
+  def set_ledger(
+    self,
+    file_name
+    ):
+    """Record the resources used by the computation of each setting in a ledger.
+
+    Each computed setting appends its wall time, CPU time, peak resident memory,
+    number of bytes read and written and outcome to the file file_name,
+    see :class:`doce.ledger.Ledger`.
+
+  	Parameters
+  	----------
+
+    file_name : str
+      path to the JSON lines file of the ledger. If empty, nothing is recorded.
+
+    Examples
+    --------
+
+    >>> import doce
+    >>> e=doce.Experiment()
+    >>> e.set_ledger('/tmp/experiment_ledger.jsonl')
+    >>> e._ledger.file_name
+    '/tmp/experiment_ledger.jsonl'
+    """
+    self._ledger = doce.Ledger(file_name) if file_name else None
+
+  def set_trace(
+    self,
+    file_name
+    ):
+    """Record the timeline of the computation in the Chrome trace event format.
+
+    The steps of the settings, the checks for available outputs, the storage
+    writes and the reductions are recorded with the worker that computed them,
+    and the trace is written to the file file_name at the end of each computation,
+    see :class:`doce.tracer.Tracer`. Previously recorded events are discarded.
+
+  	Parameters
+  	----------
+
+    file_name : str
+      path to the JSON file of the trace. If empty, nothing is recorded.
+
+    See Also
+    --------
+
+    doce.experiment.Experiment.trace
+    """
+    self._tracer = doce.Tracer(file_name) if file_name else None
+    if self._tracer:
+      self._tracer.clear()
+
+  def trace(
+    self,
+    name,
+    category='user',
+    **args
+    ):
+    """Returns a context recording its span in the trace, if a trace is set.
+
+    This is useful to display in the trace the phases of the step function,
+    for instance the storage of the outputs.
+
+  	Parameters
+  	----------
+
+    name : str
+      the name of the span.
+
+    category : str
+      the category of the span (default 'user').
+
+    **args : any type
+      arguments displayed with the span.
+
+    Examples
+    --------
+
+    >>> import numpy as np
+    >>> import doce
+    >>> e=doce.Experiment()
+    >>> with e.trace('save', 'storage'):
+    ...   np.save('/tmp/data.npy', np.zeros(10))
+    """
+    if self._tracer:
+      return self._tracer.span(name, category, **args)
+    return contextlib.nullcontext()
+
   def __str__(
     self,
     style='str'
@@ -346,7 +440,10 @@ class Experiment():
     progress='d',
     log_file_name='',
     mail_interval=0,
-    tag=''
+    tag='',
+    backend='thread',
+    profile=None,
+    monitor=None
     ):
     r"""Operate the function with parameters on the :term:`settings<setting>` set
     generated using :term:`selector`.
@@ -369,6 +466,10 @@ class Experiment():
       A function that operates on a given setting within the experiment environnment
       with optional parameters.
 
+      If the function is a coroutine function (async def), it is run on a new
+      event loop with at most nb_jobs settings in flight, see :meth:`~doce.experiment.Experiment.aperform`,
+      which should be awaited instead within a running event loop.
+
       If None, a description of the given setting is shown.
 
     *parameters : any type (optional)
@@ -408,6 +509,22 @@ class Experiment():
     tag : string (optional)
       specify a tag to be added to the output names
 
+    backend : str (optional)
+      if 'thread', the settings are computed by threads when nb_jobs > 1 (default).
+
+      If 'process', the settings are computed by a pool of processes.
+      Please refer to :meth:`doce.Plan.perform` for details.
+
+    profile : :class:`~doce.profiler.Profiler` or str (optional)
+      if set, the computation of each setting is profiled with cProfile,
+      and optionally tracemalloc, see :class:`doce.profiler.Profiler`.
+      A str is the path where the statistics of a profiler with default options are stored.
+
+    monitor : :class:`~doce.monitor.Monitor` (optional)
+      if set, the progress of the computation (settings done, failed, skipped and in flight,
+      throughput, ETA and worker utilization) is exposed in the Prometheus text format
+      on a local HTTP endpoint or in a file, see :class:`doce.monitor.Monitor`.
+
     See Also
     --------
 
@@ -439,6 +556,8 @@ class Experiment():
     1+5=6
     1+2=3
     3+5=8
+    >>> # computation by 3 processes, suited to steps bound by Python computations
+    >>> nb_failed = e.perform([], my_function, nb_jobs=3, progress='', backend='process') # doctest: +SKIP
     """
 
     return self._plan.select(selector).perform(
@@ -448,7 +567,88 @@ class Experiment():
       nb_jobs=nb_jobs,
       progress=progress,
       log_file_name=log_file_name,
-      mail_interval=mail_interval
+      mail_interval=mail_interval,
+      backend=backend,
+      profile=profile,
+      monitor=monitor
+      )
+
+  async def aperform(
+    self,
+    selector,
+    function,
+    *parameters,
+    nb_jobs=1,
+    progress='d',
+    log_file_name=''
+    ):
+    r"""Await the coroutine function with parameters on the :term:`settings<setting>` set
+    generated using :term:`selector`.
+
+    The settings are computed concurrently on the running event loop, with at most
+    nb_jobs settings in flight. This method can be awaited from a notebook or a service.
+    :meth:`doce.experiment.Experiment.perform` also accepts coroutine functions,
+    and runs them on a new event loop.
+
+    This function is essentially a wrapper to the function :meth:`doce.Plan.aperform`.
+
+    Parameters
+    ----------
+
+    selector : a list of literals or a list of lists of literals
+      :term:`selector` used to specify the :term:`settings<setting>` set
+
+    function : coroutine function(:class:`~doce.Plan`, :class:`~doce.Experiment`, \*parameters)
+      A coroutine function that operates on a given setting within the experiment
+      environnment with optional parameters.
+
+    *parameters : any type (optional)
+      parameters to be given to the function.
+
+    nb_jobs : int (optional)
+      maximal number of settings computed concurrently (default 1).
+
+      If nb_jobs < 1, all the settings may be computed concurrently.
+
+    progress : str (optional)
+      display progress of scheduling the setting set.
+
+    log_file_name : str (optional)
+      path to a file where potential errors will be logged.
+
+      If empty, the execution is stopped on the first faulty setting (default).
+
+    See Also
+    --------
+
+    doce.Plan.aperform
+
+    Examples
+    --------
+
+    >>> import asyncio
+    >>> import doce
+
+    >>> e=doce.Experiment()
+    >>> e.add_plan('plan', factor1=[1, 3], factor2=[2, 5])
+
+    >>> async def my_function(setting, experiment):
+    ...  await asyncio.sleep(0.01*setting.factor2)
+    ...  print(f'{setting.factor1}+{setting.factor2}={setting.factor1+setting.factor2}')
+
+    >>> nb_failed = asyncio.run(e.aperform([], my_function, nb_jobs=4, progress=''))
+    1+2=3
+    3+2=5
+    1+5=6
+    3+5=8
+    """
+    return await self._plan.select(selector).aperform(
+      function,
+      self,
+      *parameters,
+      nb_jobs=nb_jobs,
+      progress=progress,
+      log_file_name=log_file_name
       )
 
   def select(self, selector, show=False, plan_order_factor=None):
@@ -471,13 +671,11 @@ class Experiment():
       self._plan = getattr(self, plans[0])
     else:
       if experiment_id == 'all':
-        o_plans = []
         for plan in plans:
           if show:
             print(f'Plan {plan}:')
             print(getattr(self, plan).as_panda_frame())
-          o_plans.append(getattr(self, plan))
-        self._plan = self._plan.merge(o_plans)
+        self._plan = self._merge_plans()
         if show and len(plans)>1:
           print('Those plans can be selected using the selector parameter.')
           print('Otherwise the merged plan is considered: ')
@@ -671,6 +869,17 @@ class Experiment():
     self._plan = getattr(self, name)
     self._plans.append(name)
   
+  def _merge_plans(self):
+    """returns the merge of the plans of the experiment.
+
+    The merged plan is cached until one of the plans is modified or replaced.
+    """
+    plans = [getattr(self, plan) for plan in self.plans()]
+    key = tuple((id(plan), plan._version) for plan in plans)
+    if self._merged_plan is None or self._merged_plan[0] != key:
+      self._merged_plan = (key, self._plan.merge(plans))
+    return self._merged_plan[1]
+
   def get_current_plan(self):
     return self._plan
 
@@ -718,17 +927,218 @@ class Experiment():
     getattr(self, plan).default(factor, modality)
 
   def skip_setting(self, setting):
+    """Returns True if resuming and an output of the setting is available in a data sink.
+
+    The data sinks of the metrics, where :meth:`save_output` and :meth:`append_output`
+    store the outputs, are checked in their manifest, see :class:`doce.manifest.Manifest`,
+    so that they are scanned at most once. The other directories are checked
+    for .npy files named after the setting.
+    """
     if self._resume:
+      identifier = setting.identifier()
+      sinks = {getattr(self.metric, metric)['path'] for metric in self.metric.name()}
       for path in self.__getattribute__('path').__dict__.keys():
-        if path.endswith('.h5'):
-          print('todo')
-        else:
-          if path not in self._doce_paths:
-            check = glob.glob(f'{self.path.__getattribute__(path)}{setting.identifier()}_*.npy')
-            if check:
+        # the _raw members are the same paths before expansion
+        if path not in self._doce_paths and not path.endswith('_raw'):
+          sink = self.path.__getattribute__(path)
+          if path in sinks:
+            if sink and self._manifest(sink).has_output(identifier):
+              return True
+          elif not sink.endswith('.h5'):
+            if glob.glob(f'{glob.escape(sink+identifier)}_*.npy'):
               return True
     return False
 
+  def _manifest(self, sink):
+    """returns the manifest of the data sink."""
+    key = os.path.abspath(sink)
+    if key not in self._manifests:
+      self._manifests.setdefault(key, doce.Manifest(sink))
+    return self._manifests[key]
+
+  def save_output(self, setting, output, data, path='output'):
+    """Store the output of a setting in an .npy file, and record it in the manifest of the data sink.
+
+    The data is written to a temporary file renamed to <identifier>_<output>.npy,
+    so that an output is never partially available. Recording the output
+    in the manifest avoids a scan of the data sink when resuming.
+    The summary statistics of the output are stored in <identifier>_<output>.summary.json,
+    so that the metrics reduced by np.mean, np.std, np.var, np.min or np.max
+    do not read the output, see :class:`doce.summary.Summary`.
+
+  	Parameters
+  	----------
+
+    setting : :class:`doce.setting.Setting`
+      the setting.
+
+    output : str
+      the name of the output.
+
+    data : array_like
+      the data to be stored.
+
+    path : str (optional)
+      a member of the name_space self.path, the directory where the output is stored (default 'output').
+
+    Examples
+    --------
+
+    >>> import shutil
+    >>> import numpy as np
+    >>> import doce
+
+    >>> import os
+    >>> shutil.rmtree('/tmp/save_output', ignore_errors=True)
+    >>> e=doce.Experiment()
+    >>> e.set_path('output', '/tmp/save_output', force=True)
+    >>> e.add_plan('plan', factor1=[1, 3], factor2=[2, 4])
+    >>> e.set_metric(name='sum')
+    >>> def my_function(setting, experiment):
+    ...   experiment.save_output(setting, 'sum', setting.factor1+setting.factor2)
+    >>> nb_failed = e.perform([0], my_function, progress='')
+    >>> print(np.load('/tmp/save_output/factor1=1+factor2=2_sum.npy'))
+    3
+    >>> sorted(os.listdir('/tmp/save_output'))
+    ['factor1=1+factor2=2_sum.npy', 'factor1=1+factor2=2_sum.summary.json', 'factor1=1+factor2=4_sum.npy', 'factor1=1+factor2=4_sum.summary.json']
+    >>> e.missing_outputs([])
+    {'factor1=3+factor2=2': ['sum'], 'factor1=3+factor2=4': ['sum']}
+    >>> nb_failed = e.perform([1], my_function, progress='')
+    >>> sorted(open('/tmp/save_output/.doce_manifest').read().split())
+    ['factor1=1+factor2=2_sum', 'factor1=1+factor2=4_sum', 'factor1=3+factor2=2_sum', 'factor1=3+factor2=4_sum']
+    >>> e.missing_outputs([])
+    {}
+    """
+    directory = self.path.__getattribute__(path)
+    identifier = setting.identifier()
+    manifest = self._manifest(directory)
+    with self.trace('save output', 'storage', output=output):
+      current = manifest.is_current()
+      file_name = f'{directory}{identifier}_{output}.npy'
+      temporary_file_name = f'{file_name}.tmp'
+      with open(temporary_file_name, 'wb') as file:
+        np.save(file, data)
+      os.replace(temporary_file_name, file_name)
+      summary = doce.Summary()
+      summary.update(data)
+      doce.summary.save(file_name, summary)
+      manifest.add(identifier, output, current)
+
+  def append_output(self, setting_group, output, data):
+    """Append data to an output of a setting stored in an .h5 file, and update its summary statistics.
+
+    The data is appended to the output if it is an expandable array,
+    and replaces its content otherwise. The output is then available for resuming,
+    and recorded in the manifest of the .h5 file, see :class:`doce.manifest.Manifest`.
+
+    The summary statistics of the output are stored
+    as an attribute of the array, so that the metrics reduced by np.mean, np.std,
+    np.var, np.min or np.max do not read the output, see :class:`doce.summary.Summary`.
+    The statistics are ignored if the number of elements of the array has changed since,
+    for instance if data was appended by other means, or if the array has been rewritten in place,
+    which is detected by a stamp of some of its rows, see :func:`doce.summary.stamp`.
+    As checking every element would require reading the array, the attribute doce_summary
+    of the array should be removed if only a few elements are modified in place by other means.
+
+  	Parameters
+  	----------
+
+    setting_group : a Pytables Group
+      the group of the setting, as returned by :meth:`doce.experiment.Experiment.add_setting_group`.
+
+    output : str
+      the name of the output.
+
+    data : array_like
+      the data to be appended.
+
+    Examples
+    --------
+
+    >>> import numpy as np
+    >>> import tables as tb
+    >>> import doce
+
+    >>> e = doce.Experiment()
+    >>> e.set_path('output', '/tmp/append_output.h5', force=True)
+    >>> e.add_plan('plan', n=[1, 2])
+    >>> e.set_metric(name='loss_mean', output='loss', func=np.mean)
+    >>> def step(setting, experiment):
+    ...   h5 = tb.open_file(experiment.path.output, mode='a')
+    ...   setting_group = experiment.add_setting_group(h5, setting)
+    ...   for epoch in range(10):
+    ...     experiment.append_output(setting_group, 'loss', setting.n*np.arange(epoch, epoch+10))
+    ...   h5.close()
+    >>> e.perform([], step, progress='')
+    0
+    >>> with tb.open_file('/tmp/append_output.h5') as h5:
+    ...   print(h5.root['n=2'].loss._v_attrs.doce_summary['mean'])
+    18.0
+    """
+    with self.trace('append output', 'storage', output=output):
+      node = setting_group._f_get_child(output)
+      data = np.asarray(data, dtype=node.dtype)
+      summary = doce.Summary()
+      if hasattr(node, 'append'):
+        if node.nrows:
+          summary = doce.summary.load_h5(node)
+          if summary is None:
+            # the output was written by other means
+            summary = doce.Summary()
+            summary.valid = False
+        node.append(data)
+      else:
+        node[:] = data
+        data = np.broadcast_to(data, node.shape)
+      summary.update(data)
+      doce.summary.save_h5(node, summary)
+      if node.nrows and 'doce_written' not in node._v_attrs:
+        # unlike the arrays created by add_setting_group, the output is now available
+        manifest = self._manifest(node._v_file.filename)
+        current = manifest.is_current()
+        node._v_attrs.doce_written = True
+        node._v_file.flush()
+        manifest.add(setting_group._v_name, output, current)
+
+  def missing_outputs(self, selector=None):
+    """Returns the outputs required by the metrics that are not available, for each setting.
+
+    The availability is checked in the manifest of each data sink,
+    see :class:`doce.manifest.Manifest`.
+
+  	Parameters
+  	----------
+
+    selector : a list of literals or a list of lists of literals (optional)
+      :term:`selector` used to specify the :term:`settings<setting>` set.
+      If None, the current selection is considered.
+
+  	Returns
+  	-------
+
+    missing : dict
+      for each setting with missing outputs, the list of the missing outputs indexed by the identifier.
+
+    See Also
+    --------
+
+    doce.experiment.Experiment.save_output
+    """
+    outputs = []
+    for metric in self.metric.name():
+      output = (getattr(self.metric, metric)['output'], getattr(self.metric, metric)['path'])
+      if output not in outputs:
+        outputs.append(output)
+    missing = {}
+    plan = self._plan if selector is None else self._plan.select(selector)
+    for setting in plan:
+      identifier = setting.identifier()
+      missing_outputs = [output for output, path in outputs
+        if not self._manifest(self.path.__getattribute__(path)).has_output(identifier, output)]
+      if missing_outputs:
+        missing[identifier] = missing_outputs
+    return missing
+
   def get_output(self, output='', selector=None, path='', tag='', plan=None):
     """ Get the output vector from an .npy or a group of a .h5 file.
 
@@ -806,10 +1216,7 @@ class Experiment():
       plan = getattr(self, plan)
     else:
       if len(self.plans()) > 1:
-        o_plans = []
-        for plan in self.plans():
-          o_plans.append(getattr(self, plan))
-        self._plan = self._plan.merge(o_plans)
+        self._plan = self._merge_plans()
       plan = self._plan
 
     if path:
@@ -941,6 +1348,18 @@ class Experiment():
     #   setting_encoding={'factor_separator':'_', 'modality_separator':'_'}
     group_name = setting.identifier(**setting_encoding)
     # print(group_name)
+    with self.trace('add setting group', 'storage'):
+      return self._add_setting_group(file_id, setting, group_name, output_dimension)
+
+  def _add_setting_group(
+    self,
+    file_id,
+    setting,
+    group_name,
+    output_dimension
+    ):
+    import tables as tb
+
     if not file_id.__contains__('/'+group_name):
       setting_group = file_id.create_group('/', group_name, str(setting))
     else:
@@ -962,6 +1381,12 @@ class Experiment():
             output,
             np.zeros((output_dimension[output]))*np.nan,
             description)
+        else:
+          # the array is about to be written again
+          attributes = setting_group._f_get_child(output)._v_attrs
+          for attribute in ('doce_summary', 'doce_written'):
+            if attribute in attributes:
+              attributes._f_remove(attribute)
       else:
         if setting_group.__contains__(output):
           setting_group._f_get_child(output)._f_remove()
@@ -1089,9 +1514,10 @@ def get_from_path(
     else:
       if tag:
         path += tag+'/'
+      snapshot = doce.manifest.Snapshot(path)
       for setting in settings:
         file_name = f'{path}{setting.identifier(**setting_encoding)}_{metric}.npy'
-        if os.path.exists(file_name):
+        if snapshot.has_output(setting.identifier(**setting_encoding), metric):
           if verbose:
             print(f'Found {file_name}')
           setting_metric.append(np.load(file_name))
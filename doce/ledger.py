@@ -0,0 +1,270 @@
+"""Record the resources used by the computation of each setting of the doce module."""
+
+import os
+import sys
+import time
+import threading
+import doce.util as eu
+
+class Ledger():
+  """Append-only record of the computation of the settings of an experiment.
+
+  Each computation of a setting appends a line to a JSON lines file.
+  Each line is keyed by the :term:`setting` identifier and the run_id
+  of the experiment status, and stores:
+
+  - start: the start time of the computation, in seconds since the epoch,
+  - wall: the duration of the computation in seconds,
+  - cpu: the CPU time in seconds of the thread computing the setting,
+  - peak_rss: the peak resident memory of the process in bytes,
+  - read_bytes, write_bytes: the number of bytes read and written by the thread,
+  - outcome: 'success' or 'failure',
+  - exception: the type of the raised exception if any,
+  - pid, thread: the process and the thread that computed the setting.
+
+  The resident memory and the number of bytes are read from the /proc
+  file system and are None if it is not available.
+  The peak resident memory is the one of the process, and is shared by
+  concurrent settings of the thread backend.
+
+  The ledger of an experiment is set using :meth:`doce.experiment.Experiment.set_ledger`.
+
+  Examples
+  --------
+
+  >>> import os
+  >>> import doce
+
+  >>> if os.path.exists('/tmp/ledger.jsonl'):
+  ...   os.remove('/tmp/ledger.jsonl')
+  >>> e = doce.Experiment()
+  >>> e.add_plan('plan', n=[10, 1000000], kind=['list', 'range'])
+  >>> e.set_ledger('/tmp/ledger.jsonl')
+  >>> def step(setting, experiment):
+  ...   if setting.kind == 'list':
+  ...     sum(list(range(setting.n)))
+  ...   else:
+  ...     sum(range(setting.n))
+  >>> e.perform([], step, progress='')
+  0
+  >>> entries = e._ledger.entries()
+  >>> len(entries)
+  4
+  >>> entries[0]['identifier'], entries[0]['outcome']
+  ('kind=list+n=10', 'success')
+  >>> sorted(entries[0]['setting'].items())
+  [('kind', 'list'), ('n', '10')]
+  """
+
+  def __init__(self, file_name):
+    self.file_name = file_name
+
+  def start(self, concurrent=False):
+    """returns the resource usage before computing a setting.
+
+    If concurrent is True, other settings are computed by the same thread,
+    and only the wall time is measured.
+    """
+    usage = {'start': time.time(), 'wall': time.perf_counter()}
+    if not concurrent:
+      usage['cpu'] = time.thread_time()
+      usage.update(_thread_io())
+      try:
+        # reset the peak resident memory of the process
+        with open('/proc/self/clear_refs', 'w') as file:
+          file.write('5')
+      except OSError:
+        pass
+    return usage
+
+  def record(self, setting, experiment, usage, exception=None):
+    """appends the entry of a computed setting to the ledger.
+
+    The usage is the one returned by :meth:`doce.ledger.Ledger.start`
+    before the computation of the setting.
+    """
+    entry = {
+      'run_id': experiment.status.run_id,
+      'identifier': setting.identifier(),
+      'setting': {
+        factor: str(getattr(setting, factor)) for factor in setting._plan.factors()
+        if factor not in setting._removed
+        },
+      'start': usage['start'],
+      'wall': time.perf_counter()-usage['wall'],
+      'cpu': None,
+      'peak_rss': None,
+      'read_bytes': None,
+      'write_bytes': None,
+      'outcome': 'success' if exception is None else 'failure',
+      'exception': None if exception is None else type(exception).__name__,
+      'pid': os.getpid(),
+      'thread': threading.get_ident()
+      }
+    if 'cpu' in usage:
+      entry['cpu'] = time.thread_time()-usage['cpu']
+      entry['peak_rss'] = _peak_rss()
+      for field, value in _thread_io().items():
+        if value is not None and usage[field] is not None:
+          entry[field] = value-usage[field]
+    eu.append_json_line(self.file_name, entry)
+    return entry
+
+  def entries(self, run_id=None):
+    """returns the list of entries of the ledger, restricted to a run if run_id is set.
+
+    The lines that cannot be parsed, for instance torn by concurrent appends
+    on a network file system, are skipped with a warning, see :func:`doce.util.append_json_line`.
+    """
+    return [entry for entry in eu.read_json_lines(self.file_name)
+      if run_id is None or entry['run_id'] == run_id]
+
+  def data_frame(self, run_id=None):
+    """returns the entries of the ledger as a pandas DataFrame,
+    with a column per factor.
+    """
+    import pandas as pd
+
+    entries = self.entries(run_id)
+    data_frame = pd.DataFrame(
+      [{**entry['setting'], **{field: value for field, value in entry.items() if field != 'setting'}}
+      for entry in entries]
+      )
+    return data_frame
+
+  def cost(self, run_id=None):
+    """returns a function estimating the wall time of a setting from the successful entries.
+
+    The estimate of a setting already computed is its mean wall time.
+    The estimate of another setting sums the mean wall time of all the entries
+    and the deviation of the mean wall time of the entries sharing each of its modalities.
+    The returned function may be given to :meth:`doce.Plan.schedule`
+    or :meth:`doce.Plan.shard`.
+
+    Examples
+    --------
+
+    >>> import os
+    >>> import time
+    >>> import doce
+
+    >>> if os.path.exists('/tmp/ledger_cost.jsonl'):
+    ...   os.remove('/tmp/ledger_cost.jsonl')
+    >>> e = doce.Experiment()
+    >>> e.add_plan('plan', n_layers=[2, 8], data=['a', 'b'])
+    >>> e.set_ledger('/tmp/ledger_cost.jsonl')
+    >>> def step(setting, experiment):
+    ...   time.sleep(setting.n_layers/100)
+    >>> e.perform([{'n_layers': 2}, {'n_layers': 8, 'data': 'a'}], step, progress='')
+    0
+
+    The setting n_layers=8+data=b has not been computed yet,
+    but is expected to be longer than the settings with n_layers=2.
+
+    >>> cost = e._ledger.cost()
+    >>> for setting in list(e._plan.select([]).schedule(cost))[:2]:
+    ...   print(setting)
+    n_layers=8+data=a
+    n_layers=8+data=b
+    """
+    walls = {}
+    modality_walls = {}
+    for entry in self.entries(run_id):
+      if entry['outcome'] == 'success':
+        walls.setdefault(entry['identifier'], []).append(entry['wall'])
+        for factor, modality in entry['setting'].items():
+          modality_walls.setdefault((factor, modality), []).append(entry['wall'])
+    mean_wall = sum(sum(wall) for wall in walls.values())/max(sum(len(wall) for wall in walls.values()), 1)
+    walls = {identifier: sum(wall)/len(wall) for identifier, wall in walls.items()}
+    modality_walls = {modality: sum(wall)/len(wall)-mean_wall for modality, wall in modality_walls.items()}
+
+    def cost(setting):
+      identifier = setting.identifier()
+      if identifier in walls:
+        return walls[identifier]
+      estimate = mean_wall
+      for factor in setting._plan.factors():
+        if factor not in setting._removed:
+          estimate += modality_walls.get((factor, str(getattr(setting, factor))), 0)
+      return max(estimate, 0)
+    return cost
+
+  def report(self, run_id=None, top=10):
+    """returns a textual report of the settings that are the most demanding.
+
+    The report lists the top slowest and most memory hungry settings,
+    and for each factor, the resources used by the settings of each modality.
+
+    Examples
+    --------
+
+    >>> import doce
+    >>> l = doce.Ledger('/tmp/ledger.jsonl')
+    >>> print(l.report(top=2)) # doctest: +SKIP
+    4 settings, 0 failed, 0.08 seconds
+    <BLANKLINE>
+    Slowest settings:
+      identifier  wall   cpu  peak_rss
+    ...
+    """
+    data_frame = self.data_frame(run_id)
+    if data_frame.empty:
+      return 'No entry in the ledger.'
+    factors = [column for column in data_frame.columns if column not in _fields]
+    data_frame['failed'] = data_frame['outcome'] == 'failure'
+    columns = ['identifier', 'wall', 'cpu', 'peak_rss', 'read_bytes', 'write_bytes']
+    lines = [
+      f"{len(data_frame)} settings, {data_frame['failed'].sum()} failed, "
+      f"{data_frame['wall'].sum():.2f} seconds",
+      '',
+      'Slowest settings:',
+      data_frame.nlargest(top, 'wall')[columns].to_string(index=False),
+      ''
+      ]
+    if data_frame['peak_rss'].notna().any():
+      lines += [
+        'Most memory hungry settings:',
+        data_frame.nlargest(top, 'peak_rss')[columns].to_string(index=False),
+        ''
+        ]
+    for factor in factors:
+      aggregate = data_frame.groupby(factor, sort=False).agg(
+        settings=('wall', 'size'),
+        failed=('failed', 'sum'),
+        wall=('wall', 'sum'),
+        mean_wall=('wall', 'mean'),
+        cpu=('cpu', 'sum'),
+        peak_rss=('peak_rss', 'max')
+        ).sort_values('wall', ascending=False)
+      lines += [f'By {factor}:', aggregate.to_string(), '']
+    return '\n'.join(lines)
+
+_fields = (
+  'run_id', 'identifier', 'start', 'wall', 'cpu', 'peak_rss', 'read_bytes',
+  'write_bytes', 'outcome', 'exception', 'pid', 'thread'
+  )
+
+def _thread_io():
+  """returns the number of bytes read and written by the current thread."""
+  try:
+    with open('/proc/thread-self/io') as file:
+      io = dict(line.split(': ') for line in file.read().splitlines())
+    return {'read_bytes': int(io['rchar']), 'write_bytes': int(io['wchar'])}
+  except (OSError, KeyError, ValueError):
+    return {'read_bytes': None, 'write_bytes': None}
+
+def _peak_rss():
+  """returns the peak resident memory of the process in bytes."""
+  try:
+    with open('/proc/self/status') as file:
+      for line in file:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])*1024
+  except OSError:
+    pass
+  try:
+    import resource
+  except ImportError:
+    return None
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak_rss if sys.platform == 'darwin' else peak_rss*1024
@@ -0,0 +1,292 @@
+"""Index the outputs available in the data sinks of the doce module."""
+
+import os
+import fnmatch
+import threading
+from bisect import bisect_left, insort
+
+class Manifest():
+  """Index of the outputs stored in a data sink, a directory of .npy files or an .h5 file.
+
+  For a directory, each output is stored in a file named <identifier>_<output>.npy.
+  For an .h5 file, each output is stored in the array <identifier>/<output>,
+  and only the arrays written by :meth:`doce.experiment.Experiment.append_output` are indexed,
+  as the arrays created by :meth:`doce.experiment.Experiment.add_setting_group`
+  are placeholders until written.
+  The index is built by a single scan of the sink, and stored in a manifest file
+  next to the outputs, .doce_manifest in the directory or <file>.doce_manifest
+  for an .h5 file. The manifest file is reused as long as it is more recent than the sink,
+  and the sink is scanned again otherwise, for instance when outputs are written
+  or removed by other means. Outputs written by :meth:`doce.experiment.Experiment.save_output`
+  or :meth:`doce.experiment.Experiment.append_output` are appended to the manifest file
+  if it was up to date, so that it remains valid without scanning the sink.
+
+  Checking whether an output is available for a setting is then a lookup
+  instead of a scan of the sink, see :meth:`doce.experiment.Experiment.skip_setting`.
+
+  Examples
+  --------
+
+  >>> import os
+  >>> import shutil
+  >>> import numpy as np
+  >>> import doce
+
+  >>> shutil.rmtree('/tmp/manifest', ignore_errors=True)
+  >>> os.makedirs('/tmp/manifest')
+  >>> np.save('/tmp/manifest/f=1_accuracy.npy', np.ones(3))
+  >>> np.save('/tmp/manifest/f=1_duration.npy', np.ones(3))
+  >>> np.save('/tmp/manifest/f=2_accuracy.npy', np.ones(3))
+  >>> m = doce.Manifest('/tmp/manifest/')
+  >>> m.has_output('f=1'), m.has_output('f=3')
+  (True, False)
+  >>> sorted(m.outputs('f=1'))
+  ['accuracy', 'duration']
+  >>> current = m.is_current()
+  >>> np.save('/tmp/manifest/f=3_accuracy.npy', np.ones(3))
+  >>> m.add('f=3', 'accuracy', current)
+  >>> m.has_output('f=3', 'accuracy'), doce.Manifest('/tmp/manifest/').has_output('f=3', 'accuracy')
+  (True, True)
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._keys = None
+    self._valid_time = 0
+
+  def __getstate__(self):
+    # the index is loaded again from the manifest file, for instance by a worker process
+    return {'path': self.path}
+
+  def __setstate__(self, state):
+    self.__init__(state['path'])
+
+  def _h5(self):
+    return self.path.endswith('.h5')
+
+  def _separator(self):
+    return '/' if self._h5() else '_'
+
+  def file_name(self):
+    """returns the path to the manifest file."""
+    if self._h5():
+      return self.path+'.doce_manifest'
+    return os.path.join(self.path, '.doce_manifest')
+
+  def _sink_time(self):
+    try:
+      return os.stat(self.path).st_mtime_ns
+    except OSError:
+      return None
+
+  def is_current(self):
+    """returns True if the manifest file is more recent than the sink."""
+    sink_time = self._sink_time()
+    try:
+      return sink_time is not None and os.stat(self.file_name()).st_mtime_ns > sink_time
+    except OSError:
+      return False
+
+  def refresh(self):
+    """scans the sink again if it has been modified since the index was loaded."""
+    with self._lock:
+      if self._keys is not None and self._sink_time() != self._valid_time:
+        self._keys = None
+
+  def load(self):
+    """returns the sorted keys of the outputs stored in the sink, loading or building the index if needed."""
+    if self._keys is not None:
+      return self._keys
+    with self._lock:
+      if self._keys is None:
+        sink_time = self._sink_time()
+        keys = None
+        try:
+          if self.is_current():
+            with open(self.file_name()) as file:
+              keys = sorted({line.rstrip('\n') for line in file if line.strip()})
+        except OSError:
+          keys = None
+        if keys is None:
+          keys = self._scan()
+          sink_time = self._sink_time()
+        self._valid_time = sink_time
+        self._keys = keys
+    return self._keys
+
+  def _scan(self):
+    """lists the outputs stored in the sink and writes the manifest file."""
+    sink_time = self._sink_time()
+    keys = []
+    if self._h5():
+      if os.path.exists(self.path):
+        import tables as tb
+        with tb.open_file(self.path, mode='r') as h5:
+          for group in h5.root._f_iter_nodes('Group'):
+            for node in group._f_iter_nodes():
+              if 'doce_written' in node._v_attrs:
+                keys.append(group._v_name+'/'+node._v_name)
+    else:
+      keys = Snapshot(self.path).keys()
+    # if the sink is modified during the scan, the manifest file would miss
+    # the outputs recorded meanwhile by other processes, and is not written
+    if sink_time is not None and self._sink_time() == sink_time:
+      try:
+        # write then rename, so that the manifest file is never partial
+        temporary_file_name = self.file_name()+'.tmp'
+        with open(temporary_file_name, 'w') as file:
+          file.writelines(key+'\n' for key in keys)
+        os.replace(temporary_file_name, self.file_name())
+        self._touch()
+      except OSError:
+        pass
+    return keys
+
+  def _touch(self):
+    # the manifest is valid as long as it is more recent than the sink,
+    # which the resolution of the file times may not tell
+    sink_time = self._sink_time()
+    if sink_time is not None and os.stat(self.file_name()).st_mtime_ns <= sink_time:
+      os.utime(self.file_name(), ns=(sink_time+1, sink_time+1))
+
+  def add(self, identifier, output, current=False):
+    """records that the output of the setting of given identifier is stored in the sink.
+
+    The output is appended to the manifest file if current is True, that is if
+    the manifest file was up to date before the output was written, see :meth:`is_current`.
+    Otherwise the manifest file is outdated by the modification of the sink,
+    and the sink will be scanned when needed. The sink is not scanned by this method.
+    """
+    key = identifier+self._separator()+output
+    with self._lock:
+      if current:
+        try:
+          with open(self.file_name(), 'a') as file:
+            file.write(key+'\n')
+          self._touch()
+        except OSError:
+          pass
+      keys = self._keys
+      if keys is not None:
+        index = bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+          insort(keys, key)
+        self._valid_time = self._sink_time()
+
+  def has_output(self, identifier, output=None):
+    """returns True if the given output, or any output if None,
+    of the setting of given identifier is stored in the sink."""
+    keys = self.load()
+    prefix = identifier+self._separator()
+    if output is not None:
+      key = prefix+output
+      index = bisect_left(keys, key)
+      return index < len(keys) and keys[index] == key
+    index = bisect_left(keys, prefix)
+    return index < len(keys) and keys[index].startswith(prefix)
+
+  def outputs(self, identifier):
+    """returns the list of the outputs of the setting of given identifier stored in the sink."""
+    keys = self.load()
+    prefix = identifier+self._separator()
+    outputs = []
+    index = bisect_left(keys, prefix)
+    while index < len(keys) and keys[index].startswith(prefix):
+      outputs.append(keys[index][len(prefix):])
+      index += 1
+    return outputs
+
+class Snapshot():
+  """Listing of a directory of .npy files, obtained by a single scan of the directory.
+
+  Each output is stored in a file named <identifier>_<output>.npy, and is
+  indexed by the key <identifier>_<output>. The size and the time of last modification
+  of a file are read when requested, from the entry of the scan when the file system provides it.
+
+  A snapshot is taken once per call of :meth:`doce.metric.Metric.reduce`,
+  :func:`doce.experiment.get_from_path` and :meth:`doce.Plan.clean_data_sink`,
+  instead of checking the files of each setting, which is costly on network file systems.
+
+  Examples
+  --------
+
+  >>> import os
+  >>> import shutil
+  >>> import numpy as np
+  >>> import doce
+
+  >>> shutil.rmtree('/tmp/snapshot', ignore_errors=True)
+  >>> os.makedirs('/tmp/snapshot')
+  >>> np.save('/tmp/snapshot/f=1_accuracy.npy', np.ones(3))
+  >>> np.save('/tmp/snapshot/f=1_duration.npy', np.ones(3))
+  >>> np.save('/tmp/snapshot/f=2_accuracy.npy', np.ones(3))
+  >>> s = doce.manifest.Snapshot('/tmp/snapshot')
+  >>> s.has_output('f=1', 'accuracy'), s.has_output('f=2', 'duration')
+  (True, False)
+  >>> s.size('f=1', 'accuracy')
+  152
+  >>> s.match('f=1', '*')
+  ['f=1_accuracy.npy', 'f=1_duration.npy']
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._entries = {}
+    self._names = []
+    try:
+      with os.scandir(path) as entries:
+        for entry in entries:
+          self._entries[entry.name] = entry
+    except OSError:
+      pass
+    self._names = sorted(self._entries)
+
+  def keys(self):
+    """returns the sorted keys of the outputs stored in the directory."""
+    return [name[:-len('.npy')] for name in self._names if name.endswith('.npy')]
+
+  def file_name(self, identifier, output):
+    """returns the path to the file storing the output of the setting of given identifier."""
+    return os.path.join(self.path, identifier+'_'+output+'.npy')
+
+  def has_output(self, identifier, output):
+    """returns True if the output of the setting of given identifier is stored in the directory."""
+    return identifier+'_'+output+'.npy' in self._entries
+
+  def has_file(self, name):
+    """returns True if a file of given name is stored in the directory."""
+    return name in self._entries
+
+  def stat(self, identifier, output):
+    """returns the os.stat_result of the file storing the output, or None if not available."""
+    entry = self._entries.get(identifier+'_'+output+'.npy')
+    if entry is None:
+      return None
+    try:
+      return entry.stat()
+    except OSError:
+      return None
+
+  def size(self, identifier, output):
+    """returns the size in bytes of the file storing the output, or None if not available."""
+    stat = self.stat(identifier, output)
+    return None if stat is None else stat.st_size
+
+  def modification_time(self, identifier, output):
+    """returns the time of last modification of the file storing the output, or None if not available."""
+    stat = self.stat(identifier, output)
+    return None if stat is None else stat.st_mtime
+
+  def match(self, identifier='', wildcard='*'):
+    """returns the sorted names of the files matching identifier+wildcard,
+    ignoring the hidden files as :func:`glob.glob` does."""
+    pattern = identifier+wildcard
+    names = []
+    index = bisect_left(self._names, identifier)
+    while index < len(self._names) and self._names[index].startswith(identifier):
+      name = self._names[index]
+      if (not name.startswith('.') or pattern.startswith('.')) and fnmatch.fnmatchcase(name, pattern):
+        names.append(name)
+      index += 1
+    return names
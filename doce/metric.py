@@ -2,11 +2,18 @@
 
 import os
 import inspect
+import sys
+import json
+import marshal
+import hashlib
+import functools
 import types
 from itertools import compress
 import time
 import numpy as np
 import doce.util as eu
+from doce.manifest import Snapshot
+import doce.summary as summary
 
 class Metric():
   """Stores information about the way evaluation metrics are stored and manipulated.
@@ -70,6 +77,10 @@ class Metric():
     path,
     setting_encoding=None,
     verbose = False,
+    nb_jobs=1,
+    backend='thread',
+    cache=False,
+    snapshots=None
     ):
     """Handle reduction of the metrics when considering numpy storage.
 
@@ -77,6 +88,18 @@ class Metric():
     For each metric, a .npy file is assumed to be available which the following
     naming convention: <id_of_setting>_<metric_name>.npy.
 
+    If nb_jobs > 1, the settings are reduced by nb_jobs threads, so that the reads overlap,
+    or by nb_jobs processes if backend is 'process', for reduction functions bound by Python computations.
+    The order of the rows is preserved.
+
+    If cache is True, the reduced values and the data needed by the significance test are stored
+    in the file <directory>.doce_reduction beside each directory, and are reused as long as
+    the size and the time of last modification of the file of the output are unchanged,
+    and the reduction function and the percent flag are the same, see :meth:`doce.metric.Metric.reduce`.
+
+    Each directory is scanned once, and the snapshot is stored in the dict snapshots if given,
+    so that successive reductions share it.
+
     The method :meth:`doce.metric.Metric.reduce` wraps this method and
     should be considered as the main user interface, please see its documentation for usage.
 
@@ -96,47 +119,88 @@ class Metric():
       setting_encoding = {}
 
     (reduced_metrics, metric_direction, do_testing) = self.significance_status()
-    
+
+    # a single scan per directory instead of checking each file
+    if snapshots is None:
+      snapshots = {}
+    caches = {}
+    for metric in self.name():
+      output_path = getattr(path, getattr(self, metric)['path'])
+      if output_path not in snapshots:
+        snapshots[output_path] = Snapshot(output_path)
+        if cache:
+          caches[output_path] = _ReductionCache(output_path)
+
+    reduction_types = [self.__getattribute__(metric) for metric in self.name()]
+    output_paths = [getattr(path, reduction_type['path']) for reduction_type in reduction_types]
+    keys = [_function_key(reduction_type['func']) for reduction_type in reduction_types]
+    keys = [None if key is None else f"{key}:{reduction_type['percent']}"
+      for key, reduction_type in zip(keys, reduction_types)]
+    settings_factors = []
+    tasks = []
     for setting in settings:
-      row = []
-      raw_data_row = []
-      nb_reduced_metrics = 0
-      for metric_index, metric in enumerate(self.name()):
-        output = getattr(self, metric)['output']
-        output_path = getattr(path, getattr(self, metric)['path'])
-        file_name = output_path+setting.identifier(**setting_encoding)+'_'+output+'.npy'
-        if os.path.exists(file_name):
-          mod = os.path.getmtime(file_name)
-          modification_time_stamp.append(mod)
-          if verbose:
-            print('Found '+file_name+', last modified '+time.ctime(mod))
+      setting_identifier = setting.identifier(**setting_encoding)
+      outputs = []
+      for metric_index, reduction_type in enumerate(reduction_types):
+        output = reduction_type['output']
+        output_path = output_paths[metric_index]
+        file_name = output_path+setting_identifier+'_'+output+'.npy'
+        if snapshots[output_path].has_output(setting_identifier, output):
           metric_has_data[metric_index] = True
-          data = np.load(file_name)
-          reduction_type=self.__getattribute__(metric)
-          reduced_metrics[nb_reduced_metrics] = True
-          nb_reduced_metrics+=1
-          value = reduction_type['func'](data)
-          if reduction_type['percent']:
-            value *= 100
-          row.append(value)
-          if reduction_type['significance']:
-            raw_data_row.append(data.flatten())
+          reduced_metrics[metric_index] = True
+          cached = None
+          if cache and keys[metric_index] is not None:
+            cached = caches[output_path].get(
+              os.path.basename(file_name),
+              snapshots[output_path].stat(setting_identifier, output),
+              keys[metric_index],
+              reduction_type['significance'])
+          summarized = (not reduction_type['significance'] and summary.supports(reduction_type['func'])
+            and snapshots[output_path].has_file(os.path.basename(summary.file_name(file_name))))
+          outputs.append((file_name, True, cached, summarized))
         else:
-          if verbose:
-            print('** Unable to find '+file_name)
-          reduction_type=self.__getattribute__(metric)
+          outputs.append((file_name, False, None, False))
+      settings_factors.append([getattr(setting, factor_name) for factor_name in settings.factors()])
+      tasks.append(outputs)
+
+    # only the settings with outputs missing from the cache are loaded
+    def loaded(outputs):
+      return any(available and cached is None for (_, available, cached, _) in outputs)
+    results = _map(_reduce_from_npy, [(reduction_types, outputs, verbose) for outputs in tasks if loaded(outputs)],
+      nb_jobs, backend)
+    for factors, outputs in zip(settings_factors, tasks):
+      if loaded(outputs):
+        (metric_results, messages) = next(results)
+      else:
+        (metric_results, messages) = _reduce_from_npy(reduction_types, outputs, verbose)
+      for message in messages:
+        print(message)
+      row = []
+      raw_data_row = []
+      for metric_index, reduction_type in enumerate(reduction_types):
+        if metric_results[metric_index] is None:
           row.append(np.nan)
           if reduction_type['significance']:
             raw_data_row.append(np.nan)
-          nb_reduced_metrics+=1
-
+          continue
+        (value, raw, mod, identity) = metric_results[metric_index]
+        modification_time_stamp.append(mod)
+        row.append(value)
+        if reduction_type['significance']:
+          raw_data_row.append(raw)
+        (file_name, _, cached, _) = outputs[metric_index]
+        if cache and cached is None and keys[metric_index] is not None:
+          caches[output_paths[metric_index]].set(
+            os.path.basename(file_name), identity, mod, keys[metric_index], value, raw)
       if row and not all(np.isnan(c) for c in row):
-        for factor_name in reversed(settings.factors()):
-          row.insert(0, setting.__getattribute__(factor_name))
-        table.append(row)
-        
+        table.append(factors+row)
         raw_data.append(raw_data_row)
 
+    # let the workers finish
+    next(results, None)
+    for output_path, reduction_cache in caches.items():
+      reduction_cache.save(snapshots[output_path].keys())
+
     p_values = significance(
       settings,
       table,
@@ -216,31 +280,40 @@ class Metric():
         if verbose:
           print('Found Group '+setting.identifier(**setting_encoding))
         setting_group = h5_fid.root._f_get_child(setting.identifier(**setting_encoding))
+        # each output is read once, even if several metrics reduce it
+        outputs = {}
         for metric_index, metric in enumerate(self.name()):
           reduction_type=self.__getattribute__(metric)
           no_data = True
+          value = None
           if setting_group.__contains__(reduction_type['output']):
-            data = setting_group._f_get_child(reduction_type['output'])
-            if data.shape[0] > 0:
+            node = setting_group._f_get_child(reduction_type['output'])
+            if not reduction_type['significance']:
+              # the summary statistics avoid reading the output
+              value = _summary_value(node, reduction_type['func'])
+            if value is None and reduction_type['output'] not in outputs:
+              outputs[reduction_type['output']] = np.array(node)
+            if node.shape[0] > 0:
               metric_has_data[metric_index] = True
               reduced_metrics[nb_reduced_metrics] = True
               nb_reduced_metrics+=1
               no_data = False
             if reduction_type['significance']:
-              raw_data_row.append(np.array(data))
+              raw_data_row.append(outputs[reduction_type['output']])
           if no_data:
             row.append(np.nan)
             if reduction_type['significance']:
               raw_data_row.append(np.nan)
             nb_reduced_metrics+=1
           else:
-            value = reduction_type['func'](np.array(data))
+            if value is None:
+              value = reduction_type['func'](outputs[reduction_type['output']])
             if reduction_type['percent']:
               value *= 100
             row.append(value)
         if row and not all(np.isnan(c) for c in row):
           for factor_name in reversed(settings.factors()):
-            row.insert(0, setting.__getattribute__(factor_name))
+            row.insert(0, getattr(setting, factor_name))
         table.append(row)
         raw_data.append(raw_data_row)
  
@@ -265,7 +338,11 @@ class Metric():
     metric_display = 'long',
     metric_display_length = 2,
     reduced_metric_display = 'capitalize',
-    verbose = False
+    verbose = False,
+    nb_jobs = 1,
+    backend = 'thread',
+    cache = False,
+    snapshots = None
     ):
     """Apply the reduction directives described in each members of doce.metric.
     Metric objects for the settings given as parameters.
@@ -315,6 +392,32 @@ class Metric():
       In the case of .h5 metric storage, if verbose is set to True,
       print the group seeked for each metric.
 
+    nb_jobs : int > 0 (optional)
+      In the case of .npy metric storage, the number of settings reduced in parallel (default 1).
+      The reads of the files overlap, which reduces the duration of the reduction
+      on network file systems. The order of the settings is preserved.
+
+    backend : str (optional)
+      If 'thread' (default), the settings are reduced by threads.
+      If 'process', the settings are reduced by processes, which scales with the number of cores
+      for reduction functions bound by Python computations.
+
+    cache : bool (optional)
+      In the case of .npy metric storage, if True, the reduced values are stored in a cache
+      beside each directory, and only the outputs modified since the previous reduction are reduced again
+      (default False). An output is considered as modified if the size or the time of last modification
+      of its file changes. A reduction function is identified by its code, its default arguments,
+      and the global variables and functions it uses. The functions it calls through a module or a class
+      are not tracked, so that the cache should be cleared by removing the file <directory>.doce_reduction
+      when they are modified. The values reduced by a callable object, or a function using a variable
+      of another type than a number, a string, a tuple, a module, a class or a function, are not cached.
+
+    snapshots : dict (optional)
+      In the case of .npy metric storage, the listings of the directories, indexed by path.
+      If given, the directories already listed are not scanned again, and the listings of the other directories
+      are added, so that successive reductions, for instance one per row of a display, scan each directory once.
+      The listings should be discarded when the directories are modified.
+
     Returns
     -------
 
@@ -375,6 +478,26 @@ class Metric():
     1   2    3.97   0.93  -8.19        13
     2   3    5.00   0.91 -12.07        98
 
+    The settings can be reduced in parallel, with the same result.
+
+    >>> (parallel_setting_description,
+    ... *_) = experiment.metric.reduce(experiment._plan.select([1]), experiment.path, nb_jobs=2)
+    >>> parallel_setting_description == setting_description
+    True
+
+    The reduced values can be cached beside the directory,
+    and are then reused until the outputs are modified.
+
+    >>> import os
+    >>> (cached_setting_description,
+    ... *_) = experiment.metric.reduce(experiment._plan.select([1]), experiment.path, cache=True)
+    >>> os.path.exists('/tmp/example.doce_reduction')
+    True
+    >>> (cached_setting_description,
+    ... *_) = experiment.metric.reduce(experiment._plan.select([1]), experiment.path, cache=True)
+    >>> cached_setting_description == setting_description
+    True
+
     doce also supports metrics storage using one .h5 file sink structured
     with settings as groups et metrics as leaf nodes.
 
@@ -469,7 +592,11 @@ class Metric():
           settings,
           path,
           setting_encoding,
-          verbose)
+          verbose,
+          nb_jobs,
+          backend,
+          cache,
+          snapshots)
 
       nb_factors = len(settings.factors())
       for row_index, row in enumerate(setting_description):
@@ -644,6 +771,235 @@ class Metric():
         metric_descriptor += '\r\n'
     return metric_descriptor.rstrip()
 
+def _summary_value(node, function):
+  """returns the reduction of an array of an .h5 file by function from its summary statistics,
+  or None if not available."""
+  state = summary.load_h5(node)
+  if state is None:
+    return None
+  return state.value(function)
+
+def _reduce_from_npy(reduction_types, outputs, verbose):
+  """returns the reduced metrics of a setting, from the .npy files of its outputs,
+  or from the cache or the summary statistics of the outputs if available.
+
+  For each metric, the result is None if the output is not available,
+  and otherwise the reduced value, the flattened data if needed for the significance test,
+  the time of last modification of the file, and its identity (size, time of last modification in ns).
+  """
+  results = []
+  messages = []
+  # each output is loaded once, even if several metrics reduce it
+  loaded = {}
+  summaries = {}
+  for reduction_type, (file_name, available, cached, summarized) in zip(reduction_types, outputs):
+    if not available:
+      if verbose:
+        messages.append('** Unable to find '+file_name)
+      results.append(None)
+      continue
+    if cached is not None:
+      if verbose:
+        messages.append('Found '+file_name+' in cache, last modified '+time.ctime(cached[2]))
+      results.append(cached)
+      continue
+    if summarized:
+      if file_name not in summaries:
+        summaries[file_name] = summary.load(file_name)
+      if summaries[file_name] is not None:
+        (output_summary, mod, identity) = summaries[file_name]
+        value = output_summary.value(reduction_type['func'])
+        if value is not None:
+          if verbose:
+            messages.append('Found summary of '+file_name+', last modified '+time.ctime(mod))
+          if reduction_type['percent']:
+            value *= 100
+          results.append((value, None, mod, identity))
+          continue
+    if file_name not in loaded:
+      with open(file_name, 'rb') as file:
+        stat = os.fstat(file.fileno())
+        loaded[file_name] = (np.load(file), stat.st_mtime, (stat.st_size, stat.st_mtime_ns))
+    (data, mod, identity) = loaded[file_name]
+    if verbose:
+      messages.append('Found '+file_name+', last modified '+time.ctime(mod))
+    value = reduction_type['func'](data)
+    if reduction_type['percent']:
+      value *= 100
+    results.append((value, data.flatten() if reduction_type['significance'] else None, mod, identity))
+  return (results, messages)
+
+class _ReductionCache():
+  """Persistent cache of the values reduced from the outputs stored in a directory.
+
+  The cache is stored in the file <directory>.doce_reduction beside the directory,
+  in the .npz format: the reduced values are stored in a JSON index, and the data
+  needed by the significance test as arrays, so that no object is unpickled when loading.
+  A value is reused as long as the file of the output has the same size
+  and time of last modification, and is reduced by the same function.
+  Only numerical scalar values are cached.
+  """
+
+  def __init__(self, path):
+    self.file_name = os.path.normpath(path)+'.doce_reduction'
+    self._entries = {}
+    self._modified = False
+    try:
+      with open(self.file_name, 'rb') as file:
+        with np.load(file, allow_pickle=False) as arrays:
+          index = json.loads(str(arrays['index']))
+          for name, entry in index.items():
+            entry['identity'] = tuple(entry['identity'])
+            if entry['raw'] is not None:
+              entry['raw'] = arrays[entry['raw']]
+            self._entries[name] = entry
+    except (OSError, KeyError, ValueError, TypeError):
+      self._entries = {}
+
+  def get(self, name, stat, key, significance):
+    """returns the cached result of the file name for the reduction key, or None."""
+    entry = self._entries.get(name)
+    if (stat is None or entry is None or entry['identity'] != (stat.st_size, stat.st_mtime_ns)
+      or key not in entry['values'] or (significance and entry['raw'] is None)):
+      return None
+    (value, dtype) = entry['values'][key]
+    return (value if dtype is None else np.dtype(dtype).type(value), entry['raw'] if significance else None, entry['mtime'], entry['identity'])
+
+  def set(self, name, identity, mod, key, value, raw):
+    """stores the result of the file name for the reduction key, if the value is a numerical scalar."""
+    if isinstance(value, (bool, int, float)) and not isinstance(value, np.generic):
+      # the Python numbers are restored as such
+      cached_value = [value, None]
+    else:
+      value = np.asarray(value)
+      if value.ndim or value.dtype.kind not in 'biuf':
+        return
+      cached_value = [value.item(), value.dtype.str]
+    entry = self._entries.get(name)
+    if entry is None or entry['identity'] != identity:
+      entry = {'identity': identity, 'mtime': mod, 'values': {}, 'raw': None}
+      self._entries[name] = entry
+    entry['values'][key] = cached_value
+    if raw is not None and raw.dtype.kind in 'biuf':
+      entry['raw'] = raw
+    self._modified = True
+
+  def save(self, keys):
+    """writes the cache if modified, forgetting the files not in the list of keys of the directory."""
+    names = {key+'.npy' for key in keys}
+    for name in [name for name in self._entries if name not in names]:
+      del self._entries[name]
+      self._modified = True
+    if not self._modified:
+      return
+    index = {}
+    arrays = {}
+    for name, entry in self._entries.items():
+      index[name] = {**entry, 'identity': list(entry['identity']), 'raw': None}
+      if entry['raw'] is not None:
+        index[name]['raw'] = f'raw_{len(arrays)}'
+        arrays[index[name]['raw']] = entry['raw']
+    try:
+      # write then rename, so that the cache is never partial
+      temporary_file_name = f'{self.file_name}.{os.getpid()}.tmp'
+      with open(temporary_file_name, 'wb') as file:
+        np.savez(file, index=np.array(json.dumps(index)), **arrays)
+      os.replace(temporary_file_name, self.file_name)
+      self._modified = False
+    except OSError:
+      pass
+
+def _function_key(function):
+  """returns a key identifying a reduction function, that changes with its code, its default arguments,
+  and the variables and functions it uses, or None if the function cannot be identified,
+  for instance a callable object with a state.
+
+  The functions of a versioned package, for instance numpy, are identified by their name
+  and the version of the package. The functions called through a module or a class are not tracked.
+  """
+  key = _function_identity(function, set())
+  return None if key is None else hashlib.sha1(repr(key).encode()).hexdigest()
+
+def _function_identity(function, seen):
+  if id(function) in seen:
+    return 'recursive'
+  seen = seen | {id(function)}
+  if isinstance(function, functools.partial):
+    arguments = [_value_identity(argument, seen)
+      for argument in (*function.args, *function.keywords.values())]
+    if None in arguments:
+      return None
+    key = _function_identity(function.func, seen)
+    return None if key is None else (key, arguments, sorted(function.keywords))
+  if isinstance(function, (types.BuiltinFunctionType, np.ufunc)):
+    return (getattr(function, '__module__', None), function.__name__)
+  if not isinstance(function, types.FunctionType):
+    # for instance the numpy functions dispatching to their implementation
+    if hasattr(function, '__wrapped__'):
+      return _function_identity(function.__wrapped__, seen)
+    return None
+  package = sys.modules.get((function.__module__ or '').split('.')[0])
+  if getattr(package, '__version__', None):
+    return (function.__module__, function.__qualname__, package.__version__)
+  key = [function.__module__, function.__qualname__, hashlib.sha1(marshal.dumps(function.__code__)).hexdigest()]
+  values = []
+  for cell in function.__closure__ or ():
+    try:
+      values.append(cell.cell_contents)
+    except ValueError:
+      return None
+  values += list(function.__defaults__ or ())
+  values += [value for _, value in sorted((function.__kwdefaults__ or {}).items())]
+  names = sorted(name for name in _code_names(function.__code__) if name in function.__globals__)
+  key.append(names)
+  values += [function.__globals__[name] for name in names]
+  for value in values:
+    value_key = _value_identity(value, seen)
+    if value_key is None:
+      return None
+    key.append(value_key)
+  return tuple(key)
+
+def _value_identity(value, seen):
+  """returns a key identifying a value used by a reduction function, or None."""
+  if isinstance(value, _constant_types):
+    return repr(value)
+  if isinstance(value, tuple):
+    keys = [_value_identity(item, seen) for item in value]
+    return None if None in keys else tuple(keys)
+  if isinstance(value, types.ModuleType):
+    return ('module', value.__name__)
+  if isinstance(value, type):
+    return ('class', value.__module__, value.__qualname__)
+  if callable(value):
+    return _function_identity(value, seen)
+  return None
+
+def _code_names(code):
+  """returns the global names used by a code object and the code objects it defines."""
+  names = set(code.co_names)
+  for constant in code.co_consts:
+    if isinstance(constant, types.CodeType):
+      names |= _code_names(constant)
+  return names
+
+_constant_types = (bool, int, float, complex, str, bytes, type(None))
+
+def _map(function, tasks, nb_jobs=1, backend='thread'):
+  """returns the results of the function applied to each tuple of arguments of tasks, in order.
+
+  If nb_jobs > 1, the tasks are distributed over nb_jobs threads,
+  or processes if backend is 'process'.
+  """
+  if nb_jobs == 1:
+    return (function(*task) for task in tasks)
+  from joblib import Parallel, delayed
+  if backend == 'process':
+    parallel = Parallel(n_jobs=nb_jobs, return_as='generator')
+  else:
+    parallel = Parallel(n_jobs=nb_jobs, require='sharedmem', return_as='generator')
+  return parallel(delayed(function)(*task) for task in tasks)
+
 def significance(
   settings,
   table,
@@ -0,0 +1,190 @@
+"""Expose the progress of the computation of the settings of the doce module."""
+
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Monitor():
+  """Exposes the progress of a computation in the Prometheus text format.
+
+  While :meth:`doce.Plan.perform` is running, the following metrics are available:
+
+  - doce_settings: the number of settings to compute,
+  - doce_settings_done_total: the number of settings done, including the failed and skipped ones,
+  - doce_settings_failed_total: the number of failed settings,
+  - doce_settings_skipped_total: the number of settings skipped as their outputs are available,
+  - doce_settings_in_flight: the number of settings being computed, not available with the process backend,
+  - doce_throughput_settings_per_second: the number of settings done per second,
+  - doce_eta_seconds: the expected remaining duration of the computation,
+  - doce_workers: the number of workers,
+  - doce_worker_utilization_ratio: the ratio of time the workers spent computing settings.
+
+  Each metric is labeled with the name and the run_id of the experiment.
+  The settings in flight are reported by the workers as they start and finish, which
+  worker processes cannot do, so that this metric is only available with the thread backend
+  or when the settings are computed sequentially.
+
+  The metrics are served on http://127.0.0.1:port/metrics if port is set,
+  and written every interval seconds to the file file_name if set.
+  If port is 0, a free port is chosen. The port the metrics are served on is
+  available as the bound_port member during the computation.
+  The monitor is given to :meth:`doce.experiment.Experiment.perform`.
+
+  Examples
+  --------
+
+  >>> import doce
+
+  >>> e = doce.Experiment()
+  >>> e.name = 'example'
+  >>> e.add_plan('plan', n=[1, 2, 3])
+  >>> monitor = doce.Monitor(file_name='/tmp/doce_metrics.prom')
+  >>> e.perform([], lambda setting, experiment: None, progress='', monitor=monitor)
+  0
+  >>> print(open('/tmp/doce_metrics.prom').read()) # doctest: +ELLIPSIS
+  # HELP doce_settings Number of settings to compute.
+  # TYPE doce_settings gauge
+  doce_settings{experiment="example",run_id="..."} 3
+  # HELP doce_settings_done_total Number of settings done, including the failed and skipped ones.
+  # TYPE doce_settings_done_total counter
+  doce_settings_done_total{experiment="example",run_id="..."} 3
+  ...
+  """
+
+  def __init__(self, port=None, file_name='', interval=5):
+    self.port = port
+    self.bound_port = None
+    self.file_name = file_name
+    self.interval = interval
+    self._lock = threading.Lock()
+    self._server = None
+    self._writer = None
+    self._stopped = threading.Event()
+    self._in_flight = None
+    self._reset(None, 0, 1)
+
+  def _reset(self, experiment, nb_settings, nb_workers):
+    self._labels = ''
+    if experiment is not None:
+      self._labels = (f'{{experiment="{_escape(experiment.name)}",'
+        f'run_id="{_escape(experiment.status.run_id)}"}}')
+    self._nb_settings = nb_settings
+    self._nb_workers = nb_workers
+    self._done = 0
+    self._failed = 0
+    self._skipped = 0
+    self._busy = 0
+    self._start_time = time.time()
+    # the workers may start before the monitor, so that only an idle count is reset
+    if not self._in_flight:
+      self._in_flight = None
+
+  def start(self, experiment, nb_settings, nb_workers):
+    """starts monitoring the computation of nb_settings settings by nb_workers workers."""
+    with self._lock:
+      self._reset(experiment, nb_settings, nb_workers)
+    self._stopped.clear()
+    if self.port is not None:
+      self._server = ThreadingHTTPServer(('127.0.0.1', self.port), _handler(self))
+      self.bound_port = self._server.server_address[1]
+      threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    if self.file_name:
+      self._write()
+      self._writer = threading.Thread(target=self._write_periodically, daemon=True)
+      self._writer.start()
+
+  def started(self):
+    """accounts for a setting starting to be computed by a worker."""
+    with self._lock:
+      self._in_flight = (self._in_flight or 0)+1
+
+  def finished(self):
+    """accounts for a setting computed by a worker, successfully or not."""
+    with self._lock:
+      self._in_flight -= 1
+
+  def update(self, result):
+    """accounts for the result of settings done, as returned by the workers of :meth:`doce.Plan.perform`."""
+    with self._lock:
+      self._done += result.done
+      self._failed += result.failed
+      self._skipped += result.skipped
+      self._busy += result.busy
+
+  def stop(self):
+    """stops monitoring, and writes the final metrics to the file if set."""
+    self._stopped.set()
+    if self._writer:
+      self._writer.join()
+      self._writer = None
+    if self.file_name:
+      self._write()
+    if self._server:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
+      self.bound_port = None
+
+  def text(self):
+    """returns the metrics in the Prometheus text format."""
+    with self._lock:
+      elapsed = max(time.time()-self._start_time, 1e-9)
+      remaining = self._nb_settings-self._done
+      throughput = self._done/elapsed
+      metrics = [
+        ('doce_settings', 'gauge', 'Number of settings to compute.', self._nb_settings),
+        ('doce_settings_done_total', 'counter',
+          'Number of settings done, including the failed and skipped ones.', self._done),
+        ('doce_settings_failed_total', 'counter', 'Number of failed settings.', self._failed),
+        ('doce_settings_skipped_total', 'counter',
+          'Number of settings skipped as their outputs are available.', self._skipped),
+        ('doce_settings_in_flight', 'gauge', 'Number of settings being computed.', self._in_flight),
+        ('doce_throughput_settings_per_second', 'gauge', 'Number of settings done per second.',
+          throughput),
+        ('doce_eta_seconds', 'gauge', 'Expected remaining duration of the computation.',
+          remaining/throughput if throughput else float('nan')),
+        ('doce_workers', 'gauge', 'Number of workers.', self._nb_workers),
+        ('doce_worker_utilization_ratio', 'gauge',
+          'Ratio of time the workers spent computing settings.',
+          min(self._busy/(self._nb_workers*elapsed), 1))
+        ]
+    lines = []
+    for name, kind, description, value in metrics:
+      if value is None:
+        continue
+      lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name}{self._labels} {value:g}']
+    return '\n'.join(lines)+'\n'
+
+  def _write(self):
+    # write then rename, so that a scraper never reads a partial file
+    temporary_file_name = self.file_name+'.tmp'
+    with open(temporary_file_name, 'w') as file:
+      file.write(self.text())
+    os.replace(temporary_file_name, self.file_name)
+
+  def _write_periodically(self):
+    while not self._stopped.wait(self.interval):
+      self._write()
+
+def _escape(value):
+  """returns the value escaped as a Prometheus label value."""
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _handler(monitor):
+  """returns a request handler serving the metrics of the monitor."""
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path.split('?')[0] not in ('/', '/metrics'):
+        self.send_error(404)
+        return
+      body = monitor.text().encode()
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/plain; version=0.0.4')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+  return Handler
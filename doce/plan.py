@@ -5,20 +5,31 @@ import shutil as sh
 import inspect
 import types
 import copy
-import glob
+import hashlib
+import heapq
 import logging
 import time
-from itertools import groupby
+import asyncio
+from itertools import product
+from bisect import bisect_left, bisect_right
+from functools import reduce
+from operator import mul
 import subprocess
+import threading
 import numpy as np
 import doce.util as eu
 import doce.setting as es
+from doce.profiler import Profiler
+from doce.manifest import Snapshot
 
 if eu.in_notebook():
   from tqdm.notebook import tqdm as tqdm
 else:
   from tqdm import tqdm as tqdm
 
+# guards the computation of the setting sets of the plans
+_lock = threading.RLock()
+
 class Plan():
   """stores the different factors of the doce experiment.
 
@@ -26,6 +37,8 @@ class Plan():
   For each factor, the set of different modalities can be expressed as a list or a numpy array.
 
   To browse the setting set defined by the Plan object, one must iterate over the Plan object.
+  The settings are generated on demand during the iteration, so that browsing
+  a large setting set does not require to store it.
 
   Examples
   --------
@@ -51,15 +64,29 @@ class Plan():
     self._name = name
     self._setting = None
     self._changed = False
-    self._current_setting = 0
-    self._settings = []
+    self._selection = None
+    self._compiled_selectors = {}
+    self._modality_indexes = {}
+    self._modality_string_indexes = {}
+    self._identifier_layouts = {}
+    self._version = 0
     self._selector = None
     self._expanded_selector = None
     self._non_singleton = []
+    self._optional = []
+    self._conditions = {}
+    self._members = []
     self._factors = []
+    self._factor_indexes = None
     self._default = types.SimpleNamespace()
     self._selector_volatile = True
     self._prune_selector = True
+    self._shard = None
+    self._where = None
+    self._schedule = None
+    self._ranks = None
+    self._positions = None
+    self._exclusions = []
 
     for factor, modalities in factors.items():
       self.__setattr__(factor, modalities)
@@ -131,6 +158,8 @@ class Plan():
            should be available in the set of modalities.''')
         raise ValueError
       self._default.__setattr__(factor, modality)
+      self._identifier_layouts = {}
+      self._version += 1
     else:
       print(f'''Please set the factor {factor}\
          before choosing its default modality.''')
@@ -144,7 +173,10 @@ class Plan():
     nb_jobs=1,
     progress='d',
     log_file_name='',
-    mail_interval=0
+    mail_interval=0,
+    backend='thread',
+    profile=None,
+    monitor=None
     ):
     r"""iterate over the setting set and run the function given as parameter.
 
@@ -157,6 +189,11 @@ class Plan():
     function : function(:class:`~doce.Plan`, :class:`~doce.experiment.Experiment`, \*parameters)
       operates on a given setting within the experiment environnment with optional parameters.
 
+      If the function is a coroutine function (async def), the settings are
+      computed on a new event loop, see :meth:`doce.Plan.aperform`. The backend,
+      mail_interval, profile and monitor options are then not supported, and
+      :meth:`doce.Plan.aperform` should be awaited instead within a running event loop.
+
     experiment:
       an :class:`~doce.experiment.Experiment` object
 
@@ -177,6 +214,10 @@ class Plan():
 
       If str has an m, show the selector of the current setting.
       If str has an d, show a textual description of the current setting (default).
+      If nb_jobs > 1, the last completed setting is shown instead.
+
+      Whatever the backend, the results are consumed as they complete,
+      so that the bar shows the number of failed settings and the throughput.
 
     log_file_name : str (optional)
       path to a file where potential errors will be logged.
@@ -186,13 +227,57 @@ class Plan():
       If not empty, the execution is not stopped on a faulty setting,
       and the error is logged in the log_file_name file.
 
+    mail_interval : float (optional)
+      interval in hours between two progress mails, if strictly positive (default 0).
+
+    backend : str (optional)
+      how settings are distributed if nb_jobs > 1.
+
+      If 'thread', the settings are computed by threads sharing the experiment (default).
+
+      If 'process', the settings are computed by a pool of processes, which is faster
+      for steps bound by Python computations. The setting set is split into chunks
+      of contiguous settings, and each task only ships the plan, the experiment
+      and the ranks of a chunk. The function must then be picklable.
+
+    profile : :class:`~doce.profiler.Profiler` or str (optional)
+      if set, the computation of each setting is profiled, see :class:`doce.profiler.Profiler`.
+      A str is the path where the statistics of a profiler with default options are stored.
+      Coroutine functions cannot be profiled.
+
+    monitor : :class:`~doce.monitor.Monitor` (optional)
+      if set, the progress of the computation is exposed in the Prometheus text format,
+      see :class:`doce.monitor.Monitor`.
+
     See Also
     --------
 
     doce.experiment.Experiment.perform
 
     """
-    nb_failed = 0
+    if isinstance(profile, str):
+      profile = Profiler(profile) if profile else None
+    if inspect.iscoroutinefunction(function):
+      if profile or monitor:
+        raise ValueError('Coroutine functions cannot be profiled or monitored.')
+      if backend != 'thread' or mail_interval > 0:
+        raise ValueError('Coroutine functions are computed on an event loop, '
+          'the backend and mail_interval options are not supported.')
+      try:
+        asyncio.get_running_loop()
+      except RuntimeError:
+        pass
+      else:
+        raise RuntimeError('Coroutine functions cannot be performed within a running event loop, '
+          'await aperform instead.')
+      return asyncio.run(self.aperform(
+        function,
+        experiment,
+        *parameters,
+        nb_jobs=nb_jobs,
+        progress=progress,
+        log_file_name=log_file_name
+        ))
     if log_file_name:
       logging.basicConfig(filename=log_file_name,
                 level=logging.DEBUG,
@@ -200,42 +285,148 @@ class Plan():
                 datefmt='%m/%d/%Y %I:%M:%S')
     
       
+    selection, ranks = self._snapshot(reset_volatile=True)
+    nb_settings = selection.nb_settings if ranks is None else len(ranks)
+    settings = self._iterate(selection, ranks)
     if progress:
-      print('Number of settings: '+str(len(self)))
-    if nb_jobs>1 or nb_jobs<0:
-      from joblib import Parallel, delayed
-      Parallel(n_jobs=nb_jobs, require='sharedmem')(delayed(setting.perform)(
+      print('Number of settings: '+str(nb_settings))
+    for manifest in experiment._manifests.values():
+      # outputs may have been written or removed since the last computation
+      manifest.refresh()
+    nb_workers = 1
+    if (nb_jobs>1 or nb_jobs<0) and backend == 'process':
+      from joblib import Parallel, delayed, effective_n_jobs
+      if ranks is None:
+        ranks = range(nb_settings)
+      nb_workers = effective_n_jobs(nb_jobs)
+      # a few chunks per process balance the load while limiting the number of tasks
+      chunk_size = max(1, -(-nb_settings//(4*nb_workers)))
+      results = Parallel(n_jobs=nb_jobs, return_as='generator_unordered')(delayed(_perform_chunk)(
+        self,
+        selection,
+        ranks[start:start+chunk_size],
         function,
         experiment,
         log_file_name,
+        profile,
         *parameters
-        ) for setting in self)
+        ) for start in range(0, nb_settings, chunk_size))
+    elif nb_jobs>1 or nb_jobs<0:
+      from joblib import Parallel, delayed, effective_n_jobs
+      nb_workers = effective_n_jobs(nb_jobs)
+      results = Parallel(n_jobs=nb_jobs, require='sharedmem', return_as='generator_unordered')(
+        delayed(_perform_setting)(
+        setting,
+        function,
+        experiment,
+        log_file_name,
+        profile,
+        monitor,
+        *parameters
+        ) for setting in settings)
     else:
-      start_time = time.time()
-      step_time = start_time
-      with tqdm(total=len(self), disable = progress == '') as progress_bar:
-        for setting_index, setting in enumerate(self):
-          description = ''
-          if nb_failed:
-            description = f'[failed: {str(nb_failed)}]'
-          if 'm' in progress:
-            description += str(self._settings[setting_index])+' '
+      results = _perform_sequentially(
+        settings,
+        function,
+        experiment,
+        log_file_name,
+        profile,
+        monitor,
+        *parameters
+        )
+    try:
+      nb_failed = _track(results, nb_settings, nb_workers, experiment, progress, mail_interval, monitor)
+    finally:
+      if profile:
+        profile.close()
+      if experiment._tracer:
+        experiment._tracer.export()
+    return nb_failed
+
+  async def aperform(
+    self,
+    function,
+    experiment,
+    *parameters,
+    nb_jobs=1,
+    progress='d',
+    log_file_name=''
+    ):
+    r"""iterate over the setting set and await the coroutine function given as parameter.
+
+    The settings are computed concurrently on the running event loop,
+    with at most nb_jobs settings in flight at once. This suits steps that
+    mostly wait for disks, subprocesses or servers, as no thread is needed
+    per setting. As concurrent settings share the same thread, they are not recorded
+    in the trace of the experiment. This function is wrapped by :meth:`doce.experiment.Experiment.aperform`.
+
+    Parameters
+    ----------
+
+    function : coroutine function(:class:`~doce.Plan`, :class:`~doce.experiment.Experiment`, \*parameters)
+      operates on a given setting within the experiment environnment with optional parameters.
+
+    experiment:
+      an :class:`~doce.experiment.Experiment` object
+
+    *parameters : any type (optional)
+      parameters to be given to the function.
+
+    nb_jobs : int (optional)
+      maximal number of settings computed concurrently (default 1).
+
+      If nb_jobs < 1, all the settings may be computed concurrently.
+
+    progress : str (optional)
+      display progress of scheduling the setting set.
+
+      If str has an d, show a textual description of the last completed setting (default).
+
+    log_file_name : str (optional)
+      path to a file where potential errors will be logged.
+
+      If empty, the execution is stopped on the first faulty setting (default).
+
+      If not empty, the execution is not stopped on a faulty setting,
+      and the error is logged in the log_file_name file.
+
+    See Also
+    --------
+
+    doce.experiment.Experiment.aperform
+    """
+    if log_file_name:
+      logging.basicConfig(filename=log_file_name,
+                level=logging.DEBUG,
+                format='%(levelname)s: %(asctime)s %(message)s',
+                datefmt='%m/%d/%Y %I:%M:%S')
+    selection, ranks = self._snapshot(reset_volatile=True)
+    nb_settings = selection.nb_settings if ranks is None else len(ranks)
+    # the workers share the iterator, which is only advanced by the event loop thread
+    settings = self._iterate(selection, ranks)
+    if progress:
+      print('Number of settings: '+str(nb_settings))
+    with tqdm(total=nb_settings, disable = progress == '') as progress_bar:
+      async def worker():
+        nb_failed = 0
+        for setting in settings:
+          nb_failed += await setting.aperform(function, experiment, log_file_name, *parameters)
           if 'd' in progress:
-            description += setting.identifier()
-          progress_bar.set_description(description)
-          if function:
-            nb_failed += setting.perform(function, experiment, log_file_name, *parameters)
-          else:
-            print(setting)
-          delay = (time.time()-step_time)
-          if mail_interval>0 and setting_index<len(self)-1  and delay/(60**2) > mail_interval :
-            step_time = time.time()
-            percentage = int((setting_index+1)/len(self)*100)
-            duration = time.strftime('%dd %Hh %Mm %Ss', time.gmtime(step_time-start_time))
-            message = f'{percentage}% of settings done: {setting_index+1} over {len(self)} <br>Time elapsed: {duration}'
-            experiment.send_mail(f'progress {percentage}% ', message)
+            progress_bar.set_description(setting.identifier())
           progress_bar.update(1)
-    return nb_failed
+        return nb_failed
+
+      nb_workers = min(nb_jobs, nb_settings) if nb_jobs > 0 else nb_settings
+      workers = [asyncio.ensure_future(worker()) for _ in range(max(nb_workers, 1))]
+      try:
+        nb_failed = await asyncio.gather(*workers)
+      except BaseException:
+        # the other workers stop with the first faulty setting, or when cancelled
+        for task in workers:
+          task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    return sum(nb_failed)
 
   def check(self):
     for factor in self._factors:
@@ -244,11 +435,66 @@ class Plan():
         raise ValueError
 
   def order_factor(self, order):
-    p = {}
-    factors = [self.factors()[i] for i in order]
-    for f in factors:
-      p[f] = getattr(self, f)
-    return Plan(self.name, **p)
+    """returns a copy of the plan with the factors in the given order.
+
+    The default modalities, the conditions, the exclusions and the merged plans
+    are kept, so that the setting set is the same, browsed in a different order.
+    The selector is reset, as it refers to the factors by position.
+
+    Parameters
+    ----------
+
+    order: list of int
+      a permutation of the indexes of the factors.
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> e = doce.Experiment()
+    >>> e.add_plan('svm', classifier='svm', c=[0.1, 1.])
+    >>> e.add_plan('cnn', classifier='cnn', n_layers=[2, 4], dropout=[0., 0.5])
+    >>> p = e.select('').order_factor([1, 0, 2, 3])
+    >>> p.factors()
+    ['c', 'classifier', 'n_layers', 'dropout']
+    >>> len(p)
+    6
+    >>> for setting in p[:3]:
+    ...   print(setting)
+    c=0.1+classifier=svm
+    c=1.+classifier=svm
+    classifier=cnn+n_layers=2+dropout=0.
+
+    >>> p = doce.Plan('')
+    >>> p.classifier = ['svm', 'cnn']
+    >>> p.n_layers = [2, 4]
+    >>> p.dropout = [0., 0.5]
+    >>> p.condition('n_layers', classifier='cnn')
+    >>> p.condition('dropout', n_layers=4)
+    >>> p.exclude(dropout=0.5)
+    >>> for setting in p.order_factor([2, 1, 0]):
+    ...   print(setting)
+    dropout=0.+n_layers=4+classifier=cnn
+    n_layers=2+classifier=cnn
+    classifier=svm
+    """
+    factors = [self.factors()[index] for index in order]
+    plan = self.copy()
+    with _lock:
+      plan._factors = factors
+      plan._factor_indexes = None
+      plan._non_singleton = [factor for factor in factors if factor in self._non_singleton]
+      plan._members = [member.order_factor(
+        [member.factors().index(factor) for factor in factors if factor in member.factors()]
+        ) for member in self._members]
+      plan._selector = None
+      plan._expanded_selector = None
+      plan._compiled_selectors = {}
+      plan._identifier_layouts = {}
+      plan._version += 1
+      plan._changed = True
+    return plan
   
   def get_name(self):
     return self._name
@@ -257,7 +503,8 @@ class Plan():
     self,
     selector=None,
     volatile=False,
-    prune=True
+    prune=True,
+    where=None
     ):
     """set the selector.
 
@@ -276,12 +523,19 @@ class Plan():
 
       If False, the selector is saved for further iterations.
 
+    where: function (optional)
+      a predicate restricting the settings reached by the selector.
+      The predicate is given the modalities of many settings at once,
+      as a namespace with a numpy array per factor, and returns a boolean array.
+      The arrays of conditional factors are of object type, with None where inactive.
+      For example, where=lambda s: s.f1 != 'c' discards the settings whose f1 is 'c'.
+
   	Examples
   	--------
 
     >>> import doce
 
-    >>> p = doce.Plan()
+    >>> p = doce.Plan('plan')
     >>> p.f1=['a', 'b', 'c']
     >>> p.f2=[1, 2, 3]
 
@@ -368,14 +622,400 @@ class Plan():
     f1=c+f2=1
     f1=c+f2=2
     f1=c+f2=3
+    >>> # a predicate can further restrict the settings reached by the selector
+    >>> for setting in p.select([[0, 1], -1], where=lambda s: (s.f1 == 'b') | (s.f2 > 2)):
+    ...  print(setting)
+    f1=a+f2=3
+    f1=b+f2=1
+    f1=b+f2=2
+    f1=b+f2=3
     """
-    selector = self.__format__(selector)
+    with _lock:
+      self._compile_selector(selector, prune)
+
+      self._selector = selector
+      self._selector_volatile = volatile
+      self._prune_selector = prune
+      # set directly as a function member would be mistaken for a builtin method
+      object.__setattr__(self, '_where', where)
+      self._changed = True
+    return self
+
+  def exclude(
+    self,
+    **factors
+    ):
+    """excludes the settings with the given modalities from the setting set.
+
+    A setting is excluded if, for every factor given as parameter, its modality
+    is one of the given modalities. The excluded settings are never browsed
+    nor counted. As exclusions are stored by value, they still apply
+    if the modalities of the factors are modified afterwards.
+
+    Parameters
+    ----------
+
+    **factors: literal or list of literals
+      for each factor, the excluded modality or modalities.
+
+    See Also
+    --------
+
+    doce.Plan.include
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.classifier = ['svm', 'cnn']
+    >>> p.dropout = [0., 0.5]
+    >>> p.c = [0.1, 1.]
+
+    >>> p.exclude(classifier='svm', dropout=0.5)
+    >>> p.exclude(classifier='cnn', c=1.)
+    >>> len(p)
+    4
+    >>> for setting in p:
+    ...   print(setting)
+    classifier=svm+dropout=0.+c=0.1
+    classifier=svm+dropout=0.+c=1.
+    classifier=cnn+dropout=0.+c=0.1
+    classifier=cnn+dropout=0.5+c=0.1
+
+    The exclusions of a plan also apply to the merge of the plans of an experiment,
+    even if they are added after the merge.
+
+    >>> e = doce.Experiment()
+    >>> e.add_plan('svm', classifier='svm', c=[0.1, 1.])
+    >>> e.add_plan('cnn', classifier='cnn', dropout=[0., 0.5])
+    >>> plan = e.select('')
+    >>> len(plan)
+    4
+    >>> e.svm.exclude(c=1.)
+    >>> plan = e.select('')
+    >>> for setting in plan:
+    ...   print(setting)
+    classifier=svm+c=0.1
+    classifier=cnn+dropout=0.
+    classifier=cnn+dropout=0.5
+    """
+    for factor in factors:
+      if self._factor_index(factor) is None:
+        raise ValueError(f'{factor} is not a factor.')
+    self._exclusions.append(
+      {factor: list(np.atleast_1d(modalities)) for factor, modalities in factors.items()})
+    self._compiled_selectors = {}
+    # the merges of the plan are outdated
+    self._version += 1
+    self._changed = True
+
+  def include(
+    self,
+    condition,
+    **factors
+    ):
+    """restricts the modalities of some factors when a condition is met.
+
+    For the settings matching the condition, only the given modalities
+    of the factors given as parameters are kept in the setting set.
+    This is equivalent to excluding the settings matching the condition
+    with other modalities for each of those factors.
+
+    Parameters
+    ----------
+
+    condition: dict
+      for some factors, the modality or modalities that trigger the rule.
+
+    **factors: literal or list of literals
+      for each factor, the modality or modalities allowed when the condition is met.
+
+    See Also
+    --------
+
+    doce.Plan.exclude
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.classifier = ['svm', 'cnn']
+    >>> p.dropout = [0., 0.5]
+
+    >>> p.include({'classifier': 'svm'}, dropout=0.)
+    >>> for setting in p:
+    ...   print(setting)
+    classifier=svm+dropout=0.
+    classifier=cnn+dropout=0.
+    classifier=cnn+dropout=0.5
+    """
+    for factor, modalities in factors.items():
+      if self._factor_index(factor) is None:
+        raise ValueError(f'{factor} is not a factor.')
+      modalities = list(np.atleast_1d(modalities))
+      excluded = [modality for modality in getattr(self, factor) if modality not in modalities]
+      if excluded:
+        self.exclude(**condition, **{factor: excluded})
+
+  def condition(
+    self,
+    factor,
+    **parents
+    ):
+    """declares a factor as active only for some modalities of parent factors.
+
+    The factor is active for the settings where each parent factor given as parameter
+    has one of the given modalities. Otherwise, the factor is inactive: its value is None
+    and it is not shown in the identifier of the setting. The setting set is then the union
+    of the branches where the factor is active or not, so that the factor does not
+    multiply the number of settings where it is inactive.
+    A parent factor may itself be conditional, in order to describe a tree of factors.
+
+    Parameters
+    ----------
+
+    factor: str
+      the name of the conditional factor.
+
+    **parents: literal or list of literals
+      for each parent factor, the modality or modalities where the factor is active.
+
+    Examples
+    --------
+
+    >>> import doce
 
-    self._selector = selector
-    self._selector_volatile = volatile
-    self._prune_selector = prune
+    >>> p = doce.Plan('')
+    >>> p.classifier = ['svm', 'cnn']
+    >>> p.n_layers = [2, 4]
+    >>> p.dropout = [0., 0.5]
+
+    >>> p.condition('n_layers', classifier='cnn')
+    >>> p.condition('dropout', n_layers=4)
+    >>> len(p)
+    4
+    >>> for setting in p:
+    ...   print(setting)
+    classifier=svm
+    classifier=cnn+n_layers=2
+    classifier=cnn+n_layers=4+dropout=0.
+    classifier=cnn+n_layers=4+dropout=0.5
+    >>> print(setting.n_layers, p[0].n_layers)
+    4 None
+    """
+    for name in (factor,)+tuple(parents):
+      if self._factor_index(name) is None:
+        raise ValueError(f'{name} is not a factor.')
+    self._conditions[factor] = {
+      parent: list(np.atleast_1d(modalities)) for parent, modalities in parents.items()}
+    if factor not in self._optional:
+      self._optional.append(factor)
+    self._compiled_selectors = {}
+    self._identifier_layouts = {}
+    self._version += 1
+    self._changed = True
+
+  def shard(
+    self,
+    index=0,
+    count=1,
+    strategy='block',
+    cost=None
+    ):
+    """restricts the setting set to one of several disjoint shards.
+
+    The setting set selected by the selector is split into count disjoint shards,
+    and only the shard of given index is considered when browsing the setting set.
+    The partition only depends on the setting set, so that several processes,
+    each one handling one shard, handle every setting once. The shard is kept
+    when the selector changes, calling shard() with no parameters disables it.
+
+    Parameters
+    ----------
+
+    index: int
+      the index of the shard, between 0 and count-1.
+
+    count: int > 0
+      the number of shards.
+
+    strategy: str
+      'block': each shard is a contiguous slice of the setting set (default).
+
+      'stride': the shard of index i has the settings at positions i, i+count, i+2*count...
+
+      'cost': the settings are assigned by decreasing cost to the least loaded shard,
+      in order to balance the total cost of the shards. This requires to browse
+      the setting set to evaluate the costs.
+
+    cost: function(:class:`~doce.setting.Setting`) returning a float
+      the expected cost of a setting, required by the 'cost' strategy.
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.one = ['a', 'b', 'c']
+    >>> p.two = [1, 2]
+
+    >>> for setting in p.shard(1, 3):
+    ...   print(setting)
+    one=b+two=1
+    one=b+two=2
+    >>> for setting in p.shard(1, 3, strategy='stride'):
+    ...   print(setting)
+    one=a+two=2
+    one=c+two=1
+    >>> for setting in p.shard(0, 2, strategy='cost', cost=lambda setting: setting.two):
+    ...   print(setting)
+    one=a+two=2
+    one=c+two=1
+    one=c+two=2
+    >>> len(p.shard())
+    6
+    """
+    if count < 1 or not 0 <= index < count:
+      raise ValueError(f'Invalid shard {index} over {count} shards.')
+    if strategy not in ('block', 'stride', 'cost'):
+      raise ValueError(f'Unknown sharding strategy {strategy}.')
+    if strategy == 'cost' and cost is None:
+      raise ValueError('The cost strategy requires a cost function.')
+    with _lock:
+      self._shard = (index, count, strategy, cost) if count > 1 else None
+      self._changed = True
+    return self
+
+  def schedule(
+    self,
+    cost=None
+    ):
+    """browses the setting set by decreasing expected cost.
+
+    By default, the setting set is browsed in the order of the modality indexes.
+    When the settings are computed in parallel, settings that are long to compute
+    are then likely to start last and leave most of the jobs idle at the end.
+    Browsing the most costly settings first reduces the overall duration.
+    Settings of equal cost keep their order. The schedule is kept when the
+    selector changes, calling schedule() with no parameters disables it.
+
+    Parameters
+    ----------
+
+    cost: function(:class:`~doce.setting.Setting`) returning a float
+      the expected cost of a setting, for example the one estimated from
+      past runs by :meth:`doce.ledger.Ledger.cost`.
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.n_layers = [2, 4, 8]
+    >>> p.data = ['a', 'b']
+
+    >>> for setting in p.schedule(lambda setting: setting.n_layers**2):
+    ...   print(setting)
+    n_layers=8+data=a
+    n_layers=8+data=b
+    n_layers=4+data=a
+    n_layers=4+data=b
+    n_layers=2+data=a
+    n_layers=2+data=b
+
+    The schedule applies to each shard.
+
+    >>> for setting in p.shard(0, 2, strategy='stride'):
+    ...   print(setting)
+    n_layers=8+data=a
+    n_layers=4+data=a
+    n_layers=2+data=a
+    >>> len(p.shard().schedule())
+    6
+    """
+    with _lock:
+      object.__setattr__(self, '_schedule', cost)
+      self._changed = True
     return self
 
+  def _selected_ranks(self):
+    """returns the ranks in the selection of the settings satisfying the where predicate
+    and belonging to the shard, ordered by the schedule, or None if all the settings
+    of the selection are considered in order."""
+    if self._where is None and self._shard is None and self._schedule is None:
+      return None
+    ranks = range(self._selection.nb_settings)
+    if self._where is not None:
+      ranks = self._where_ranks()
+    if self._shard is not None:
+      ranks = self._shard_ranks(ranks)
+    if self._schedule is not None:
+      costs = [self._schedule(es.Setting(self, _unrank(self._selection, rank))) for rank in ranks]
+      ranks = [ranks[position] for position in
+        sorted(range(len(ranks)), key=lambda position: -costs[position])]
+      # the scheduled ranks are not sorted, see index_of
+      self._positions = (ranks, {rank: position for position, rank in enumerate(ranks)})
+    return ranks
+
+  def _rank_position(self, ranks, rank):
+    """returns the position of a rank of the selection in the ranks, or None if not in the ranks.
+
+    The position is computed from the start and the step of the ranks of a block
+    or stride shard, and found by bisection in the sorted ranks of a where predicate
+    or a cost shard. Only the scheduled ranks are not sorted, and their positions
+    are stored when they are scheduled.
+    """
+    positions = self._positions
+    if positions is not None and positions[0] is ranks:
+      return positions[1].get(rank)
+    if isinstance(ranks, range):
+      return ranks.index(rank) if rank in ranks else None
+    position = bisect_left(ranks, rank)
+    return position if position < len(ranks) and ranks[position] == rank else None
+
+  def _shard_ranks(self, ranks):
+    """returns the ranks belonging to the shard."""
+    index, count, strategy, cost = self._shard
+    if strategy == 'block':
+      return ranks[index*len(ranks)//count:(index+1)*len(ranks)//count]
+    if strategy == 'stride':
+      return ranks[index::count]
+    costs = [cost(es.Setting(self, _unrank(self._selection, rank))) for rank in ranks]
+    loads = [(0, shard_index) for shard_index in range(count)]
+    positions = []
+    for position in sorted(range(len(ranks)), key=lambda position: -costs[position]):
+      load, shard_index = heapq.heappop(loads)
+      if shard_index == index:
+        positions.append(position)
+      heapq.heappush(loads, (load+costs[position], shard_index))
+    return [ranks[position] for position in sorted(positions)]
+
+  def _where_ranks(self):
+    """returns the ranks of the settings of the selection satisfying the where predicate.
+
+    The predicate is evaluated once per box, on arrays spanning every setting of the box.
+    """
+    ranks = []
+    for box, offset in zip(self._selection.boxes, self._selection.offsets):
+      modalities = types.SimpleNamespace()
+      for factor_index, factor in enumerate(self._factors):
+        shape = [1]*len(box)
+        shape[factor_index] = -1
+        factor_modalities = np.asarray(getattr(self, factor))
+        if factor in self._optional:
+          factor_modalities = np.array(list(factor_modalities)+[None], dtype=object)
+        setattr(modalities, factor,
+                factor_modalities[list(box[factor_index])].reshape(shape))
+      mask = np.broadcast_to(self._where(modalities), [len(indexes) for indexes in box])
+      ranks.extend((np.flatnonzero(mask)+offset).tolist())
+    return ranks
+
   def factors(
     self
     ):
@@ -434,6 +1074,258 @@ class Plan():
       factor = self.factors()[factor]
     return len(object.__getattribute__(self, factor))
 
+  def index_of(
+    self,
+    setting
+    ):
+    """returns the position of a setting in the setting set.
+
+    Returns the position of a setting in the setting set, such that plan[position]
+    gives back the setting. The setting set is not browsed to do so.
+
+    Parameters
+    ----------
+
+    setting: :class:`~doce.setting.Setting` or list of int
+      the setting or the indexes of its modalities.
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.one = ['a', 'b', 'c']
+    >>> p.two = list(range(10))
+
+    >>> print(p[12])
+    one=b+two=2
+    >>> print(p.index_of(p[12]))
+    12
+    >>> print(p.index_of([2, 0]))
+    20
+    >>> for setting in p.select([1, [3, 4]])[-2:]:
+    ...   print(setting)
+    one=b+two=3
+    one=b+two=4
+    """
+    selection, ranks = self._snapshot()
+    if isinstance(setting, es.Setting):
+      setting = setting._setting
+    rank = _rank(selection, list(setting))
+    if rank is not None and ranks is not None:
+      rank = self._rank_position(ranks, rank)
+    if rank is None:
+      raise ValueError(f'{setting} is not in the setting set.')
+    return rank
+
+  def from_identifier(
+    self,
+    identifier,
+    factor_separator='+',
+    modality_separator='='
+    ):
+    """returns the setting described by an identifier.
+
+    Returns the setting described by an identifier, as given by
+    :meth:`doce.setting.Setting.identifier`. The factors that are not
+    described by the identifier are set to their default modality,
+    or to their unique modality.
+
+    Parameters
+    ----------
+
+    identifier: str
+      the identifier of the setting.
+
+    factor_separator: str
+      factor_separator used to concatenate the factors, default is '+'.
+
+    modality_separator: str
+      modality_separator used to concatenate
+      the factor and modality value, default is '='.
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.one = ['a', 'b']
+    >>> p.two = [0.1, 0.00001]
+    >>> p.three = ['c', 'd']
+    >>> p.default('three', 'd')
+
+    >>> setting = p.from_identifier('one=b+two=0.00001')
+    >>> print(setting)
+    one=b+two=0.00001+three=d
+    """
+    values = {}
+    if identifier:
+      for factor_modality_pair in identifier.split(factor_separator):
+        factor, modality = factor_modality_pair.split(modality_separator, 1)
+        values[factor] = modality
+    setting = []
+    for factor in self._factors:
+      if factor in values:
+        modality_index = self._modality_index(factor, values[factor], as_string=True)
+        if modality_index is None:
+          raise ValueError(f'{values[factor]} is not a modality of factor {factor}.')
+        setting.append(modality_index)
+        del values[factor]
+      elif hasattr(self._default, factor):
+        setting.append(self._modality_index(factor, getattr(self._default, factor)))
+      elif factor in self._optional:
+        setting.append(self.nb_modalities(factor))
+      elif self.nb_modalities(factor) == 1:
+        setting.append(0)
+      else:
+        raise ValueError(f'The modality of factor {factor} is not specified.')
+    if values:
+      raise ValueError(f'{", ".join(values)} is not a factor.')
+    for factor, parents in self._conditions.items():
+      factor_index = self._factor_index(factor)
+      active = all(getattr(self, parent)[setting[self._factor_index(parent)]] in modalities
+                   if setting[self._factor_index(parent)] < self.nb_modalities(parent) else False
+                   for parent, modalities in parents.items())
+      if active != (setting[factor_index] < self.nb_modalities(factor)):
+        raise ValueError(f'The modality of factor {factor} is not consistent with its condition.')
+    return es.Setting(self, setting)
+
+  def identifiers(
+    self,
+    style='long',
+    sort=True,
+    factor_separator='+',
+    modality_separator='=',
+    singleton=True,
+    default=False,
+    hide=None
+    ):
+    """returns the identifiers of the settings of the setting set.
+
+    Returns the identifiers of the settings of the setting set, in order of
+    iteration, as given by :meth:`doce.setting.Setting.identifier` with the same
+    parameters. The identifiers are built in one pass over the selection, which is
+    faster than iterating over the settings. Similarly to an iteration,
+    a volatile selector is reset after the call.
+
+    See Also
+    --------
+
+    doce.setting.Setting.identifier
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p = doce.Plan('')
+    >>> p.one = ['a', 'b']
+    >>> p.two = [0.5, 1.]
+    >>> p.three = 'c'
+    >>> p.default('one', 'a')
+
+    >>> p.select([1], volatile=True).identifiers()
+    ['one=b+three=c+two=0.5', 'one=b+three=c+two=1.']
+    >>> p.identifiers(sort=False, singleton=False)
+    ['two=0.5', 'two=1.', 'one=b+two=0.5', 'one=b+two=1.']
+    >>> p.identifiers(style='list', hide=['three'])[0]
+    ['two=0.5']
+    """
+    selection, ranks = self._snapshot(reset_volatile=True)
+    layout = self._identifier_layout(sort, modality_separator, singleton, default, hide)
+    identifiers = []
+    if ranks is not None:
+      # a shard may only span part of the boxes
+      identifiers = [
+        [parts[setting[factor_index]] for factor_index, parts in layout
+        if parts[setting[factor_index]] is not None]
+        for setting in _setting_indexes(selection, ranks)]
+      if 'list' not in style:
+        identifiers = [factor_separator.join(identifier) for identifier in identifiers]
+    else:
+      for box in selection.boxes:
+        if 'list' in style:
+          identifiers.extend(
+            [parts[setting[factor_index]] for factor_index, parts in layout
+            if parts[setting[factor_index]] is not None]
+            for setting in product(*box))
+        else:
+          identifiers.extend(_box_identifiers(box, layout, factor_separator))
+    if style == 'hash':
+      identifiers = [hashlib.md5(identifier.encode("utf-8")).hexdigest()
+                     for identifier in identifiers]
+    return identifiers
+
+  def _identifier_layout(self, sort, modality_separator, singleton, default, hide):
+    """returns the identifier parts of each modality of the displayed factors.
+
+    The layout is a list of (factor index, parts) in display order, where parts
+    gives for each modality index the 'factor=modality' string, or None if the
+    modality is not displayed. Layouts are cached until the plan is modified.
+    """
+    key = (sort, modality_separator, singleton, default, tuple(hide) if hide else ())
+    layout = self._identifier_layouts.get(key)
+    if layout is None:
+      factors = self.factors()
+      if sort:
+        factors = sorted(factors)
+      layout = []
+      for factor in factors:
+        if (factor[0] == '_' or factor in key[-1] or
+            (not singleton and factor not in self._non_singleton)):
+          continue
+        hide_default = not default and hasattr(self._default, factor)
+        parts = []
+        for modality, modality_string in zip(getattr(self, factor), self._modality_strings(factor)):
+          if modality is None or (hide_default and getattr(self._default, factor) == modality):
+            parts.append(None)
+          else:
+            parts.append(factor+modality_separator+modality_string)
+        if factor in self._optional:
+          parts.append(None)
+        layout.append((self._factor_index(factor), parts))
+      self._identifier_layouts[key] = layout
+    return layout
+
+  def _modality_strings(self, factor):
+    """returns the modalities of a factor formatted as in setting identifiers."""
+    return [np.format_float_positional(modality) if isinstance(modality, float)
+            else str(modality) for modality in getattr(self, factor)]
+
+  def _factor_index(self, factor):
+    """returns the index of a factor in the order of definition, or None if not a factor."""
+    if self._factor_indexes is None:
+      self._factor_indexes = {name: index for index, name in enumerate(self._factors)}
+    return self._factor_indexes.get(factor)
+
+  def _modality_index(self, factor, modality, as_string=False):
+    """returns the index of a modality of a factor, or None if not available.
+
+    The modality may be given as its value, or as_string, formatted as in
+    setting identifiers or with str(). The lookup tables are built at first
+    use and discarded when the factor is set.
+    """
+    if as_string:
+      if factor not in self._modality_string_indexes:
+        indexes = {}
+        for index, modality_string in enumerate(self._modality_strings(factor)):
+          indexes.setdefault(modality_string, index)
+        for index, reference_modality in enumerate(getattr(self, factor)):
+          indexes.setdefault(str(reference_modality), index)
+        self._modality_string_indexes[factor] = indexes
+      return self._modality_string_indexes[factor].get(modality)
+    if factor not in self._modality_indexes:
+      indexes = {}
+      for index, reference_modality in enumerate(getattr(self, factor)):
+        indexes.setdefault(reference_modality, index)
+      self._modality_indexes[factor] = indexes
+    try:
+      return self._modality_indexes[factor].get(modality)
+    except TypeError:
+      return None
+
   def clean_h5(
     self,
     path,
@@ -475,13 +1367,12 @@ class Plan():
       h_5 = tb.open_file(path, mode='a')
       groups = []
       if reverse:
-        ids = [setting.identifier(**setting_encoding) for setting in self]
+        ids = set(self.identifiers(**setting_encoding))
         for group in h_5.iter_nodes('/'):
           if group._v_name not in ids:
             groups.append(group._v_name)
       else:
-        for setting in self:
-          group_name = setting.identifier(**setting_encoding)
+        for group_name in self.identifiers(**setting_encoding):
           if h_5.root.__contains__(group_name):
             groups.append(group_name)
       if not force:
@@ -543,19 +1434,18 @@ class Plan():
       setting_encoding={} #'factor_separator':'_', 'modality_separator':'_'}
       self.clean_h5(path, reverse, force, keep, setting_encoding, archive_path, verbose)
     else:
+      # a single scan of the directory instead of a glob per setting
+      snapshot = Snapshot(path)
       file_names = []
-      for setting in self:
+      for identifier in self.identifiers(**setting_encoding):
         if verbose:
-          print('search path: '+path+'/'+setting.identifier(**setting_encoding)+wildcard)
-        for output_file in glob.glob(path+'/'+setting.identifier(**setting_encoding)+wildcard):
-          file_names.append(output_file)
+          print('search path: '+path+'/'+identifier+wildcard)
+        for output_file in snapshot.match(identifier, wildcard):
+          file_names.append(path+'/'+output_file)
       if reverse:
-        complete = []
-        for output_file in glob.glob(path+'/'+wildcard):
-          complete.append(output_file)
-        # print(file_names)
-        file_names = [i for i in complete if i not in file_names]
-      #   print(complete)
+        selected = set(file_names)
+        file_names = [path+'/'+output_file for output_file in snapshot.match('', wildcard)]
+        file_names = [i for i in file_names if i not in selected]
       file_names = set(file_names)
       if verbose:
         print('Selected files')
@@ -590,56 +1480,113 @@ class Plan():
         print('no files found.')
 
   def merge(self, plans):
-    # build temporary plan
-    tmp = Plan('merged')
-    for plan in plans:
-      for factor in plan.factors():
-        setattr(tmp, factor, np.empty([0]))
-        if hasattr(plan._default, factor):
-          if (hasattr(tmp._default, factor) and
-            getattr(plan._default, factor) != getattr(tmp._default, factor)
+    """returns a plan spanning the settings of several plans.
+
+    The factors of the returned plan are the union of the factors of the plans.
+    A factor that is not available in every plan is set to its default modality
+    for the settings of the plans where it is missing, or is inactive if it has
+    no default modality, so that the identifiers of the settings are preserved. Only the settings of the plans are browsed,
+    and the settings shared by several plans are browsed once.
+
+    Examples
+    --------
+
+    >>> import doce
+
+    >>> p1 = doce.Plan('p1', f1=[1, 2], f2=['a', 'b'])
+    >>> p2 = doce.Plan('p2', f1=[2, 3], f2=['a'])
+    >>> merged = p1.merge([p1, p2])
+    >>> print(merged)
+      0  f1: [1 2 3]
+      1  f2: ['a' 'b']
+    >>> for setting in merged:
+    ...   print(setting)
+    f1=1+f2=a
+    f1=1+f2=b
+    f1=2+f2=a
+    f1=2+f2=b
+    f1=3+f2=a
+    """
+    plan = Plan('merged')
+    for member in plans:
+      for factor in member.factors():
+        if hasattr(member._default, factor):
+          if (hasattr(plan._default, factor) and
+            getattr(member._default, factor) != getattr(plan._default, factor)
             ):
-            print(getattr(tmp._default, factor))
+            print(getattr(plan._default, factor))
             print(f'''While merging factors of the different experiment,
               a conflict of default modalities for the factor {factor} is detected.
               This may lead to an inconsistent behavior.''')
             raise ValueError
-          setattr(tmp._default, factor, getattr(plan._default, factor))
-            # print(tmp._default)
-    for plan in plans:
-      for factor in plan.factors():
-        for modalities in getattr(plan, factor):
-          if len(getattr(tmp, factor))==0 or modalities not in getattr(tmp, factor):
-            setattr(tmp, factor, np.append(getattr(tmp, factor), modalities))
-    # check if factors are available in every experiment
-    have = [True]*len(tmp.factors())
-    for factor_index, factor in enumerate(tmp.factors()):
-      for plan in plans:
-        if not factor in plan.factors():
-          have[factor_index] = False
-    plan = Plan('merged')
-    plan._default = tmp._default
-    for factor_index, factor in enumerate(tmp.factors()):
-      modalities = getattr(tmp, factor)
-      print(modalities)
-      if (not isinstance(modalities[0], str) and
-          all(np.array([val.is_integer() for val in modalities]))
-          ):
-        modalities = np.array(modalities, dtype=np.intc)
-      setattr(plan, factor, modalities)
-      if not have[factor_index] and not hasattr(tmp._default, factor):
-        if isinstance(modalities[0], str):
-          if '-99999' not in modalities:
-            modalities = np.append(modalities, '-99999')
-            setattr(plan, factor, modalities)
-          plan.default(factor, '-99999')
-        if not isinstance(modalities[0], str):
-          if -99999 not in modalities:
-            modalities = np.append(modalities, -99999)
-            setattr(plan, factor, modalities)
-          plan.default(factor, -99999)
+          setattr(plan._default, factor, getattr(member._default, factor))
+    modalities = {}
+    for member in plans:
+      for factor in member.factors():
+        modalities.setdefault(factor, []).append(getattr(member, factor))
+    for factor, factor_modalities in modalities.items():
+      factor_modalities = np.concatenate(factor_modalities)
+      # keep the first occurrence of each modality, in order of definition
+      factor_modalities = factor_modalities[
+        np.sort(np.unique(factor_modalities, return_index=True)[1])]
+      setattr(plan, factor, factor_modalities)
+      # a factor missing in some plans is inactive for their settings
+      if ((len(modalities[factor]) < len(plans) and not hasattr(plan._default, factor)) or
+          any(factor in member._optional for member in plans)):
+        plan._optional.append(factor)
+    plan._members = list(plans)
     return plan
 
+  def _condition_boxes(self, box, factor, parents):
+    """returns disjoint boxes spanning the settings of box that are consistent
+    with the condition of a factor: the factor is active if and only if
+    each parent factor has one of the given modalities."""
+    factor_index = self._factor_index(factor)
+    inactive = self.nb_modalities(factor)
+    active_parents = {}
+    for parent, modalities in parents.items():
+      active_parents[self._factor_index(parent)] = {
+        self._modality_index(parent, modality) for modality in modalities} - {None}
+    active_box = list(box)
+    for parent_index, indexes in active_parents.items():
+      active_box[parent_index] = tuple(index for index in box[parent_index] if index in indexes)
+    active_box[factor_index] = tuple(index for index in box[factor_index] if index != inactive)
+    inactive_box = list(box)
+    inactive_box[factor_index] = tuple(index for index in box[factor_index] if index == inactive)
+    pieces = [tuple(active_box)]+_box_difference(tuple(inactive_box), active_parents)
+    pieces = [piece for piece in pieces if _box_size(piece)]
+    if len(pieces) > 1:
+      pieces = _sorted_union(pieces)
+    return pieces
+
+  def _member_boxes(self):
+    """returns the boxes of modality indexes spanning the settings of the merged plans."""
+    boxes = []
+    for member in self._members:
+      indexes = []
+      for factor in self.factors():
+        if factor in member.factors():
+          indexes.append([self._modality_index(factor, modality)
+                          for modality in getattr(member, factor)])
+          if factor in member._optional:
+            indexes[-1].append(self.nb_modalities(factor))
+        elif hasattr(self._default, factor):
+          indexes.append([self._modality_index(factor, getattr(self._default, factor))])
+        else:
+          indexes.append([self.nb_modalities(factor)])
+      # the settings excluded from the member plan are not considered
+      member_factor_indexes = [member._factor_index(factor) for factor in self.factors()]
+      for member_box in member._compile_selector(None).boxes:
+        box = []
+        for factor_index, member_factor_index in enumerate(member_factor_indexes):
+          if member_factor_index is None:
+            box.append(tuple(indexes[factor_index]))
+          else:
+            box.append(tuple(sorted(indexes[factor_index][index]
+                                    for index in member_box[member_factor_index])))
+        boxes.append(tuple(box))
+    return boxes
+
   def as_panda_frame(self):
     """returns a panda frame that describes the Plan object.
 
@@ -762,14 +1709,16 @@ class Plan():
           if isinstance(selector[factor], list):
             factor_selector_integer = []
             for factor_selector in selector[factor]:
-              if factor_selector in getattr(self, factor):
-                factor_selector_integer.append(list(getattr(self, factor)).index(factor_selector))
+              modality_index = self._modality_index(factor, factor_selector)
+              if modality_index is not None:
+                factor_selector_integer.append(modality_index)
               else:
                 print('Error: '+str(factor_selector)+' is not a modality of factor '+factor+'.')
             integer_selector[self._factors.index(factor)] = factor_selector_integer
           else:
-            if selector[factor] in getattr(self, factor):
-              integer_selector[self._factors.index(factor)] = list(getattr(self, factor)).index(selector[factor])
+            modality_index = self._modality_index(factor, selector[factor])
+            if modality_index is not None:
+              integer_selector[self._factors.index(factor)] = modality_index
         else:
           print('Error: '+factor+' is not a factor.')
       integer_selectors.append(integer_selector)
@@ -802,11 +1751,9 @@ class Plan():
         factor = factor_modality_pair_split[0]
         modality = factor_modality_pair_split[1]
         if factor in self._factors:
-          reference_modality_string = []
-          for reference_modality in list(getattr(self, factor)):
-            reference_modality_string.append(str(reference_modality))
-          if modality in reference_modality_string:
-            selector[self._factors.index(factor)] = reference_modality_string.index(modality)
+          modality_index = self._modality_index(factor, modality, as_string=True)
+          if modality_index is not None:
+            selector[self._factors.index(factor)] = modality_index
           else:
             raise Exception(f'Error: {modality} is not a modality of factor {factor}.')
         else:
@@ -821,6 +1768,9 @@ class Plan():
         if factor_index<len(self._factors):
           # print(type(getattr(self, self._factors[factor_index])))
           nb_modalities = len(np.atleast_1d(getattr(self, self._factors[factor_index])))
+          if self._factors[factor_index] in self._optional:
+            # the index following the modalities stands for the factor being inactive
+            nb_modalities += 1
           if factor_selector != -1:
             for factor_selector_modality in factor_selector:
               if factor_selector_modality+1 > nb_modalities:
@@ -865,10 +1815,18 @@ class Plan():
     ):
     if not hasattr(self, name) and name[0] != '_':
       self._factors.append(name)
+      self._factor_indexes = None
     if hasattr(self, name) and isinstance(inspect.getattr_static(self, name), types.FunctionType):
       raise Exception(f'the attribute {name} is shadowing a builtin function')
     if name == '_selector' or name[0] != '_':
       self._changed = True
+    if name[0] != '_':
+      self._compiled_selectors = {}
+      self._modality_indexes.pop(name, None)
+      self._modality_string_indexes.pop(name, None)
+    if name[0] != '_' or name == '_default':
+      self._identifier_layouts = {}
+      self._version += 1
     if (name[0] != '_' and
         ((isinstance(value, list) and value) or
         isinstance(value, np.ndarray) and value.size) and
@@ -896,126 +1854,168 @@ class Plan():
     name):
 
     self._changed = True
+    if name[0] != '_':
+      self._compiled_selectors = {}
+      self._modality_indexes.pop(name, None)
+      self._modality_string_indexes.pop(name, None)
+      self._identifier_layouts = {}
+      self._version += 1
     if hasattr(self, name) and name[0] != '_':
       self._factors.remove(name)
+      self._factor_indexes = None
       if name in self._non_singleton:
         self._non_singleton.remove(name)
+      if name in self._optional:
+        self._optional.remove(name)
+      self._conditions.pop(name, None)
     return object.__delattr__(self, name)
 
   def __iter__(
     self
     ):
+    """returns an iterator over the setting set.
 
-    self.__set_settings__()
-    self._current_setting = 0
-    return self
-
-  def __next__(
-    self
-    ):
+    Each iterator browses the setting set as selected when the iterator is created,
+    so that nested loops or concurrent threads over the same plan do not interfere.
+    A volatile selector is disabled as soon as the iterator is created.
+    """
+    selection, ranks = self._snapshot(reset_volatile=True)
+    return self._iterate(selection, ranks)
 
-    if self._current_setting == len(self._settings):
-      if self._selector_volatile:
-        self._selector = None
-      raise StopIteration
-    else:
-      self._setting = self._settings[self._current_setting]
-      self._current_setting += 1
-      return es.Setting(self)
+  def _iterate(self, selection, ranks):
+    for setting in _setting_indexes(selection, ranks):
+      yield es.Setting(self, setting)
 
   def __getitem__(self, index):
-    self.__set_settings__()
-    return  self
+    selection, ranks = self._snapshot()
+    if ranks is None:
+      ranks = range(selection.nb_settings)
+    if isinstance(index, slice):
+      return [es.Setting(self, _unrank(selection, rank)) for rank in ranks[index]]
+    if index < -len(ranks) or index >= len(ranks):
+      raise IndexError('setting index out of range')
+    return es.Setting(self, _unrank(selection, ranks[index]))
 
 
   def __len__(
     self
     ):
-    self.__set_settings__()
-    return len(self._settings)
+    selection, ranks = self._snapshot()
+    if ranks is not None:
+      return len(ranks)
+    return selection.nb_settings
 
   def __set_settings__(
     self
     ):
-    if self._changed:
-      settings = []
-      selectors = copy.deepcopy(self._selector)
-      self._setting = None
-      # selector = copy.deepcopy(selector)
-      nb_factors = len(self.factors())
-      if selectors is None or len(selectors)==0 or (len(selectors)==1 and len(selectors)==0) :
-        selectors = [[-1]*nb_factors]
-      if isinstance(selectors, list) and not all(isinstance(x, list) for x in selectors):
-        selectors = [selectors]
-
-      for selector_index, selector in enumerate(selectors):
-        if len(selector) < nb_factors:
-          selectors[selector_index] = selector+[-1]*(nb_factors-len(selector))
-        for factor_selector_index, factor_selector in enumerate(selector):
-          if not isinstance(factor_selector, list) and factor_selector > -1:
-            selectors[selector_index][factor_selector_index] = [factor_selector]
-      # prune repeated entries
-      for selector_index, selector in enumerate(selectors):
-        if isinstance(selector, list):
-          for factor_selector_index, factor_selector in enumerate(selector):
-            if isinstance(factor_selector, list):
-              selector[factor_selector_index] = list(dict.fromkeys(factor_selector))
-      self._expanded_selector = selectors
-
-      if self._check_selector(selectors):
-        for selector in selectors:
-          # handle -1 in selectors
-          for factor_selector_index, factor_selector in enumerate(selector):
-            if (isinstance(factor_selector, int) and
-                factor_selector == -1 and
-                factor_selector_index<len(self.factors())
-                ):
-              modalities = self.__getattribute__(self.factors()[factor_selector_index])
-              if isinstance(modalities, list) or isinstance(modalities, np.ndarray):
-                selector[factor_selector_index] = list(range(len(np.atleast_1d(modalities))))
-              else:
-                selector[factor_selector_index] = [0]
+    with _lock:
+      if self._changed:
+        self._selection = self._compile_selector(self._selector, self._prune_selector)
+        self._expanded_selector = self._selection.expanded_selector
+        self._ranks = self._selected_ranks()
+        self._changed = False
 
-          settings_from_selector = self.__set_settings_selector__(selector, 0)
-          if all(isinstance(setting_from_selector, list) for setting_from_selector in settings_from_selector):
-            for setting_from_selector in settings_from_selector:
-              settings.append(setting_from_selector)
+  def _snapshot(self, reset_volatile=False):
+    """returns the selection and the ranks describing the current setting set.
+
+    Both are never modified afterwards, so that they can be browsed while the plan
+    is modified or selected again. If reset_volatile is True, the setting set is about
+    to be browsed and a volatile selector is disabled.
+    """
+    with _lock:
+      self.__set_settings__()
+      snapshot = (self._selection, self._ranks)
+      if reset_volatile and self._selector_volatile:
+        self._selector = None
+        object.__setattr__(self, '_where', None)
+    return snapshot
+
+  def _compile_selector(self, selector, prune=True):
+    """returns the selection described by a selector.
+
+    The selection is computed once per selector and cached
+    until the factors of the plan are modified.
+    """
+    key = (_selector_key(selector), prune)
+    if key not in self._compiled_selectors:
+      if len(self._compiled_selectors) >= 1024:
+        self._compiled_selectors.clear()
+      self._compiled_selectors[key] = self._build_selection(
+        copy.deepcopy(self.__format__(selector)),
+        prune
+        )
+    return self._compiled_selectors[key]
+
+  def _build_selection(self, selectors, prune):
+    """expands a list based selector into boxes of modality indexes."""
+    nb_factors = len(self.factors())
+    if selectors is None or len(selectors)==0:
+      selectors = [[-1]*nb_factors]
+    if isinstance(selectors, list) and not all(isinstance(x, list) for x in selectors):
+      selectors = [selectors]
+
+    for selector_index, selector in enumerate(selectors):
+      if len(selector) < nb_factors:
+        selectors[selector_index] = selector+[-1]*(nb_factors-len(selector))
+      for factor_selector_index, factor_selector in enumerate(selectors[selector_index]):
+        if not isinstance(factor_selector, list) and factor_selector > -1:
+          selectors[selector_index][factor_selector_index] = [factor_selector]
+    # prune repeated entries
+    for selector in selectors:
+      for factor_selector_index, factor_selector in enumerate(selector):
+        if isinstance(factor_selector, list):
+          selector[factor_selector_index] = list(dict.fromkeys(factor_selector))
+
+    boxes = []
+    if self._check_selector(selectors):
+      for selector in selectors:
+        # handle -1 in selectors
+        box = []
+        for factor_index, factor in enumerate(self.factors()):
+          if isinstance(selector[factor_index], list):
+            box.append(tuple(selector[factor_index]))
           else:
-            settings.append(settings_from_selector)
-        pruned_settings = [k for k,v in groupby(sorted(settings))]
-        if self._prune_selector and len(pruned_settings) < len(settings):
-          settings = pruned_settings
-        self._changed = False
-        self._settings = settings
-
-  def __set_settings_selector__(self, selector, done):
-    if done == len(selector):
-      return []
-
-    last_settings = self.__set_settings_selector__(selector, done+1)
-    if isinstance(selector[done], list):
-      settings = []
-      for modalities in selector[done]:
-        if len(last_settings) > 0:
-          for last_setting in last_settings:
-            if isinstance(last_setting, list):
-              last_setting = list(last_setting)
-            else:
-              last_setting = [last_setting]
-            last_setting.insert(0, modalities)
-            settings.append(last_setting)
-        else:
-          setting = list(last_settings)
-          setting.insert(0, modalities)
-          settings.append(setting)
-    else:
-      settings = last_settings
-      if len(settings) > 0 and all(isinstance(setting, list) for setting in settings):
-        for setting in settings:
-          setting.insert(0, selector[done])
-      else:
-        settings.insert(0, selector[done])
-    return settings
+            box.append(tuple(range(
+              len(np.atleast_1d(getattr(self, factor)))+(factor in self._optional))))
+        boxes.append(tuple(box))
+      for factor, parents in self._conditions.items():
+        if any(self._factor_index(name) is None for name in (factor,)+tuple(parents)):
+          continue
+        boxes = [piece for box in boxes for piece in self._condition_boxes(box, factor, parents)]
+      if self._members:
+        # restrict to the settings of the merged plans, each of them being reached once
+        member_boxes = self._member_boxes()
+        restricted_boxes = []
+        for box in boxes:
+          intersections = [_box_intersection(box, member_box) for member_box in member_boxes]
+          intersections = [box for box in intersections if _box_size(box)]
+          if len(intersections) > 1:
+            intersections = _sorted_union(intersections)
+          restricted_boxes += intersections
+        boxes = restricted_boxes
+      for exclusion in self._exclusions:
+        if any(self._factor_index(factor) is None for factor in exclusion):
+          continue
+        excluded = {}
+        for factor, modalities in exclusion.items():
+          excluded[self._factor_index(factor)] = {
+            self._modality_index(factor, modality) for modality in modalities} - {None}
+        boxes = [piece for box in boxes for piece in _box_difference(box, excluded)]
+      boxes = [box for box in boxes if _box_size(box)]
+      if prune and len(boxes) > 1:
+        pruned_boxes = _sorted_union(boxes)
+        if sum(map(_box_size, pruned_boxes)) < sum(map(_box_size, boxes)):
+          boxes = pruned_boxes
+    offsets = [0]
+    for box in boxes:
+      offsets.append(offsets[-1]+_box_size(box))
+    return types.SimpleNamespace(
+      expanded_selector=selectors,
+      boxes=boxes,
+      offsets=offsets[:-1],
+      nb_settings=offsets[-1],
+      positions=None
+      )
 
   def __format__(self, selector):
     if selector and (isinstance(selector, str) or isinstance(selector, dict)):
@@ -1026,6 +2026,255 @@ class Plan():
       selector = self._dict2list(selector)
     return selector
 
+def _perform_setting(setting, function, experiment, log_file_name, profiler, monitor, *parameters):
+  """runs the function on the setting, and returns the result of the run,
+  with the numbers of done, failed and skipped settings, the busy time and the setting.
+
+  If profiler is set, the run is profiled. If monitor is set, the start and the end of the run are reported.
+  """
+  if monitor:
+    monitor.started()
+  profile = profiler.start() if profiler else None
+  start_time = time.perf_counter()
+  outcome = 'success'
+  try:
+    if function:
+      outcome = setting._perform(function, experiment, log_file_name, *parameters)
+    else:
+      print(setting)
+  finally:
+    if profile:
+      profiler.stop(setting, profile)
+    if monitor:
+      monitor.finished()
+  return types.SimpleNamespace(
+    done=1,
+    failed=int(outcome == 'failure'),
+    skipped=int(outcome == 'skipped'),
+    busy=time.perf_counter()-start_time,
+    setting=setting
+    )
+
+def _perform_sequentially(settings, *arguments):
+  """yields, for each setting, an empty result announcing the setting, then the result of its run,
+  so that the progress bar shows the setting being computed."""
+  for setting in settings:
+    yield types.SimpleNamespace(done=0, failed=0, skipped=0, busy=0, setting=setting)
+    yield _perform_setting(setting, *arguments)
+
+def _perform_chunk(plan, selection, ranks, function, experiment, log_file_name, profiler, *parameters):
+  """runs the function on the settings of given ranks, and returns the result of the runs.
+
+  Runs in a worker process of :meth:`doce.Plan.perform`. The setting of the result is the last one of the chunk.
+  """
+  if log_file_name:
+    logging.basicConfig(filename=log_file_name,
+              level=logging.DEBUG,
+              format='%(levelname)s: %(asctime)s %(message)s',
+              datefmt='%m/%d/%Y %I:%M:%S')
+  result = types.SimpleNamespace(done=0, failed=0, skipped=0, busy=0, setting=None)
+  try:
+    for setting in plan._iterate(selection, ranks):
+      # the monitor of the parent process is out of reach
+      setting_result = _perform_setting(setting, function, experiment, log_file_name, profiler, None, *parameters)
+      for field in ('done', 'failed', 'skipped', 'busy'):
+        setattr(result, field, getattr(result, field)+getattr(setting_result, field))
+      result.setting = setting
+  finally:
+    if profiler:
+      profiler.close()
+  return result
+
+def _track(results, nb_settings, nb_workers, experiment, progress, mail_interval, monitor):
+  """consumes the results as they complete, updates the progress bar and the monitor,
+  sends progress mails, and returns the number of failed settings.
+  """
+  nb_done = 0
+  nb_failed = 0
+  start_time = time.time()
+  step_time = start_time
+  if monitor:
+    monitor.start(experiment, nb_settings, nb_workers)
+  try:
+    with tqdm(total=nb_settings, disable = progress == '', unit='setting') as progress_bar:
+      for result in results:
+        nb_done += result.done
+        nb_failed += result.failed
+        if monitor:
+          monitor.update(result)
+        description = ''
+        if nb_failed:
+          description = f'[failed: {str(nb_failed)}]'
+        if result.setting is not None:
+          if 'm' in progress:
+            description += str(result.setting._setting)+' '
+          if 'd' in progress:
+            description += result.setting.identifier()
+        progress_bar.set_description(description)
+        delay = (time.time()-step_time)
+        if mail_interval>0 and nb_done<nb_settings and delay/(60**2) > mail_interval :
+          step_time = time.time()
+          percentage = int(nb_done/nb_settings*100)
+          duration = time.strftime('%dd %Hh %Mm %Ss', time.gmtime(step_time-start_time))
+          message = f'{percentage}% of settings done: {nb_done} over {nb_settings} <br>Time elapsed: {duration}'
+          message += f' <br>Failed settings: {nb_failed}'
+          experiment.send_mail(f'progress {percentage}% ', message)
+        progress_bar.update(result.done)
+  finally:
+    if monitor:
+      monitor.stop()
+  return nb_failed
+
+def _setting_indexes(selection, ranks):
+  """yields the modality indexes of the settings of a selection, restricted to ranks if not None."""
+  if ranks is None:
+    for box in selection.boxes:
+      yield from product(*box)
+  elif isinstance(ranks, range) and ranks.step == 1:
+    for box, offset in zip(selection.boxes, selection.offsets):
+      start = max(ranks.start-offset, 0)
+      stop = min(ranks.stop-offset, _box_size(box))
+      if start < stop:
+        yield from _box_range(box, start, stop)
+  else:
+    for rank in ranks:
+      yield tuple(_unrank(selection, rank))
+
+def _unrank(selection, rank):
+  """returns the modality indexes of the setting of given rank in a selection."""
+  box_index = bisect_right(selection.offsets, rank)-1
+  rank -= selection.offsets[box_index]
+  setting = []
+  for factor_box in reversed(selection.boxes[box_index]):
+    rank, position = divmod(rank, len(factor_box))
+    setting.append(factor_box[position])
+  setting.reverse()
+  return setting
+
+def _rank(selection, setting):
+  """returns the rank in a selection of the setting given as modality indexes, or None."""
+  positions = selection.positions
+  if positions is None:
+    positions = [
+      [{index: position for position, index in enumerate(factor_box)} for factor_box in box]
+      for box in selection.boxes
+      ]
+    selection.positions = positions
+  for box_index, box_positions in enumerate(positions):
+    rank = 0
+    for factor_positions, index in zip(box_positions, setting):
+      if index not in factor_positions:
+        break
+      rank = rank*len(factor_positions)+factor_positions[index]
+    else:
+      return selection.offsets[box_index]+rank
+  return None
+
+def _selector_key(selector):
+  """returns a hashable version of a selector."""
+  if isinstance(selector, dict):
+    return ('dict',)+tuple((key, _selector_key(value)) for key, value in selector.items())
+  if isinstance(selector, (list, tuple, np.ndarray)):
+    return ('list',)+tuple(_selector_key(value) for value in selector)
+  if isinstance(selector, np.generic):
+    return selector.item()
+  return selector
+
+def _box_size(box):
+  """returns the number of settings spanned by a box of modality indexes."""
+  return reduce(mul, (len(factor_box) for factor_box in box), 1)
+
+def _box_difference(box, excluded):
+  """returns disjoint boxes spanning the settings of box that are not excluded.
+
+  A setting is excluded if for each factor index of the dict excluded,
+  its modality index is in the corresponding set.
+  """
+  if any(not indexes.intersection(box[factor_index]) for factor_index, indexes in excluded.items()):
+    return [box]
+  pieces = []
+  prefix = list(box)
+  for factor_index, indexes in excluded.items():
+    remaining = tuple(index for index in box[factor_index] if index not in indexes)
+    if remaining:
+      pieces.append(tuple(prefix[:factor_index])+(remaining,)+tuple(prefix[factor_index+1:]))
+    prefix[factor_index] = tuple(index for index in box[factor_index] if index in indexes)
+  if len(pieces) > 1:
+    pieces = _sorted_union(pieces)
+  return pieces
+
+def _box_intersection(box, other_box):
+  """returns the box spanning the settings spanned by both boxes, in the order of box."""
+  intersection = []
+  for factor_box, other_factor_box in zip(box, other_box):
+    other_factor_box = set(other_factor_box)
+    intersection.append(tuple(index for index in factor_box if index in other_factor_box))
+  return tuple(intersection)
+
+def _box_range(box, start, stop):
+  """yields the settings of a box of rank between start (included) and stop (excluded)."""
+  positions = []
+  rank = start
+  for factor_box in reversed(box):
+    rank, position = divmod(rank, len(factor_box))
+    positions.append(position)
+  positions.reverse()
+  for _ in range(stop-start):
+    yield tuple(factor_box[position] for factor_box, position in zip(box, positions))
+    for factor_index in range(len(box)-1, -1, -1):
+      positions[factor_index] += 1
+      if positions[factor_index] < len(box[factor_index]):
+        break
+      positions[factor_index] = 0
+
+def _box_identifiers(box, layout, factor_separator):
+  """returns the identifiers of the settings of a box, in order of enumeration.
+
+  The parts of each factor are concatenated by broadcasting object arrays,
+  each factor spanning its own axis.
+  """
+  shape = tuple(len(indexes) for indexes in box)
+  identifiers = np.full((1,)*len(box), '', dtype=object)
+  for factor_index, parts in layout:
+    factor_parts = np.array(
+      [factor_separator+parts[index] if parts[index] is not None else ''
+      for index in box[factor_index]],
+      dtype=object
+      )
+    factor_shape = [1]*len(box)
+    factor_shape[factor_index] = -1
+    identifiers = identifiers+factor_parts.reshape(factor_shape)
+  identifiers = np.broadcast_to(identifiers, shape).ravel()
+  return [identifier[len(factor_separator):] for identifier in identifiers]
+
+def _sorted_union(boxes):
+  """returns disjoint boxes spanning the union of the settings spanned by boxes.
+
+  Browsing the returned boxes one after the other reaches the settings
+  in lexicographic order of their modality indexes.
+  """
+  if not boxes[0]:
+    return [()]
+  factor_sets = [set(box[0]) for box in boxes]
+  union = []
+  suffixes_by_boxes = {}
+  previous_boxes = None
+  for index in sorted(set().union(*factor_sets)):
+    containing_boxes = tuple(
+      box_index for box_index, factor_set in enumerate(factor_sets) if index in factor_set
+      )
+    if containing_boxes not in suffixes_by_boxes:
+      suffixes_by_boxes[containing_boxes] = _sorted_union(
+        [boxes[box_index][1:] for box_index in containing_boxes]
+        )
+    suffixes = suffixes_by_boxes[containing_boxes]
+    if containing_boxes == previous_boxes and len(suffixes) == 1:
+      union[-1] = (union[-1][0]+(index,),)+suffixes[0]
+    else:
+      union += [((index,),)+suffix for suffix in suffixes]
+    previous_boxes = containing_boxes
+  return union
+
 if __name__ == '__main__':
   import doctest
   doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.NORMALIZE_WHITESPACE)
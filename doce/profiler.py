@@ -0,0 +1,148 @@
+"""Profile the computation of each setting of the doce module."""
+
+import os
+import io
+import glob
+import random
+import pstats
+import cProfile
+import warnings
+import tracemalloc
+
+class Profiler():
+  """Profiles the computation of the settings with cProfile, and optionally tracemalloc.
+
+  The computation of each sampled setting, including the checks made by doce
+  before running the function, is profiled, and the statistics are stored
+  in the directory path, in a file named after the setting identifier
+  with the .prof extension. Those files can be browsed with the pstats module or
+  any viewer supporting the cProfile format. If memory is True, the peak
+  of the memory allocated by Python and the lines allocating most of the
+  memory still in use at the end of the setting are stored in a .memory.txt file.
+
+  Only one tracemalloc trace is available per process, so that the peak memory
+  of settings computed by concurrent threads are shared. Likewise, a setting
+  cannot be profiled while another profiler is active, for instance while another
+  setting is profiled by a concurrent thread: the setting is then not profiled
+  and a warning is issued. The process backend profiles every setting.
+
+  A profiler is given to :meth:`doce.experiment.Experiment.perform`.
+
+  Parameters
+  ----------
+
+  path : str
+    the directory where the statistics are stored.
+
+  rate : float in ]0, 1]
+    the probability for a setting to be profiled (default 1, all settings are profiled).
+
+  memory : bool
+    if True, trace the memory allocations with tracemalloc (default False).
+
+  Examples
+  --------
+
+  >>> import os
+  >>> import shutil
+  >>> import doce
+
+  >>> shutil.rmtree('/tmp/profile', ignore_errors=True)
+  >>> e = doce.Experiment()
+  >>> e.add_plan('plan', n=[10, 1000000])
+  >>> def step(setting, experiment):
+  ...   sorted(range(setting.n), reverse=True)
+  >>> e.perform([], step, progress='', profile=doce.Profiler('/tmp/profile', memory=True))
+  0
+  >>> sorted(os.listdir('/tmp/profile'))
+  ['n=10.memory.txt', 'n=10.prof', 'n=1000000.memory.txt', 'n=1000000.prof']
+  >>> print(doce.Profiler('/tmp/profile').report(top=3)) # doctest: +SKIP
+  2 profiled settings
+  ...
+  """
+
+  def __init__(self, path, rate=1., memory=False):
+    if not 0 < rate <= 1:
+      raise ValueError(f'Invalid profiling rate {rate}, should be in ]0, 1].')
+    self.path = path
+    self.rate = rate
+    self.memory = memory
+    self._tracing = False
+
+  def start(self):
+    """starts profiling a setting.
+
+    Returns the profile of the setting, or None if the setting is not sampled.
+    """
+    if random.random() >= self.rate:
+      return None
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+    except ValueError:
+      warnings.warn('A setting is not profiled as another profiler is active, '
+        'use the process backend to profile concurrent settings.', RuntimeWarning)
+      return None
+    if self.memory:
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        self._tracing = True
+      tracemalloc.reset_peak()
+    return profile
+
+  def stop(self, setting, profile):
+    """stops profiling a setting and stores its statistics."""
+    profile.disable()
+    os.makedirs(self.path, exist_ok=True)
+    file_name = os.path.join(self.path, setting.identifier())
+    profile.dump_stats(file_name+'.prof')
+    if self.memory:
+      _, peak = tracemalloc.get_traced_memory()
+      statistics = tracemalloc.take_snapshot().statistics('lineno')
+      with open(file_name+'.memory.txt', 'w') as file:
+        file.write(f'peak: {peak}\n')
+        for statistic in statistics[:10]:
+          file.write(f'{statistic}\n')
+
+  def close(self):
+    """stops tracing the memory allocations if the tracing was started by the profiler."""
+    if self._tracing:
+      tracemalloc.stop()
+      self._tracing = False
+
+  def report(self, plan=None, top=20, sort='cumulative'):
+    """returns a textual report of the functions of highest cost, aggregated over the settings.
+
+    Parameters
+    ----------
+
+    plan : :class:`~doce.Plan` (optional)
+      if set, only the settings of the plan are considered, otherwise every profiled setting.
+
+    top : int
+      the number of functions and settings listed (default 20).
+
+    sort : str
+      the pstats key used to sort the functions (default 'cumulative').
+    """
+    file_names = sorted(glob.glob(os.path.join(glob.escape(self.path), '*.prof')))
+    if plan is not None:
+      identifiers = set(plan.identifiers())
+      file_names = [file_name for file_name in file_names
+        if os.path.basename(file_name)[:-len('.prof')] in identifiers]
+    if not file_names:
+      return 'No profiled setting.'
+    stream = io.StringIO()
+    stream.write(f'{len(file_names)} profiled settings\n')
+    pstats.Stats(*file_names, stream=stream).sort_stats(sort).print_stats(top)
+    peaks = []
+    for file_name in file_names:
+      memory_file_name = file_name[:-len('.prof')]+'.memory.txt'
+      if os.path.exists(memory_file_name):
+        with open(memory_file_name) as file:
+          peaks.append((int(file.readline().split()[1]), os.path.basename(file_name)[:-len('.prof')]))
+    if peaks:
+      stream.write('Peak memory allocated by Python:\n')
+      for peak, identifier in sorted(peaks, reverse=True)[:top]:
+        stream.write(f'  {peak:>14} {identifier}\n')
+    return stream.getvalue()
@@ -2,7 +2,6 @@
    of the system probed by the experiment of the dcode module."""
 
 import hashlib
-import copy
 import logging
 import traceback
 import numpy as np
@@ -19,7 +18,7 @@ class Setting():
 
   >>> import doce
 
-  >>> p = doce.Plan()
+  >>> p = doce.Plan('plan')
   >>> p.f1=['a', 'b']
   >>> p.f2=[1, 2]
 
@@ -30,34 +29,70 @@ class Setting():
   f1=b+f2=1
   f1=b+f2=2
 
+  A setting only stores the indexes of its modalities and a reference to its plan.
+  The modalities are retrieved from the plan when the members are accessed.
+  Members may also be set, or removed using :meth:`doce.setting.Setting.remove_factor`,
+  without affecting the plan.
+
+  >>> print(setting.f1)
+  b
+  >>> setting.note = 'last'
+  >>> setting.note
+  'last'
+
+  As the plan does not store a current setting while browsed, a setting built
+  from a plan without the indexes of its modalities is the first setting of the plan.
+
+  >>> print(doce.setting.Setting(p))
+  f1=a+f2=1
   """
 
+  # members set by the user are stored in a __dict__ created at first use
+  __slots__ = ('_plan', '_setting', '__dict__')
+  _removed = ()
+  _identifiers = None
+
   def __init__(self, plan, setting_array = None, positional=True):
     self._plan = plan
-    # underscore = ['_non_singleton', '_default', '_plans', '_setting']
-    # for f in underscore:
-    #   self.__setattr__(f, getattr(plan, f))
 
     if setting_array is not None and positional == False:
       setting_array_string = setting_array
+      setting_array = []
       for factor_index, factor in enumerate(plan.factors()):
-        modality_indexes = np.where(getattr(plan, factor)==setting_array_string[factor_index])
-        if len(modality_indexes[0])>0:
-          setting_array[factor_index] = modality_indexes[0][0]
+        modality_index = plan._modality_index(factor, setting_array_string[factor_index])
+        if modality_index is not None:
+          setting_array.append(modality_index)
         else:
           print(f'Unable to identify {setting_array_string[factor_index]} as a modality of factor {factor}')
           raise SystemExit
-         
 
-    if setting_array:
-      self._setting = copy.deepcopy(setting_array)
-    else:
-      self._setting = copy.deepcopy(plan._setting)
 
-    for factor_index, factor in enumerate(plan.factors()):
-      # print(self._setting[fi])
-      # print(f)
-      self.__setattr__(factor, getattr(plan, factor)[self._setting[factor_index]])
+    if setting_array is None:
+      if not len(plan):
+        raise ValueError(f'The plan {plan.get_name()} has no setting, the setting_array must be given.')
+      setting_array = plan[0]._setting
+    self._setting = tuple(setting_array)
+
+  def __getattr__(self, name):
+    if name[0] == '_':
+      raise AttributeError(name)
+    factor_index = self._plan._factor_index(name)
+    if factor_index is None or name in self._removed:
+      raise AttributeError(f'the setting has no factor {name}')
+    modalities = getattr(self._plan, name)
+    if self._setting[factor_index] == len(modalities):
+      # inactive conditional factor
+      return None
+    return modalities[self._setting[factor_index]]
+
+  def __delattr__(self, name):
+    found = name in self.__dict__
+    if found:
+      object.__delattr__(self, name)
+    if self._plan._factor_index(name) is not None and name not in self._removed:
+      self._removed += (name,)
+    elif not found:
+      raise AttributeError(name)
 
   def __str__(self):
     """returns a one-liner str with a readable description
@@ -212,6 +247,23 @@ class Setting():
     optional_parameter=value_one+three=c+two=1
 
     """
+    members = self.__dict__
+    if not any(name[0] != '_' and self._plan._factor_index(name) is not None
+               for name in members):
+      # no factor is overridden, the identifier is built from the plan layout
+      # and memoized for the current state of the plan
+      key = (style, sort, factor_separator, modality_separator, singleton, default,
+             (tuple(hide) if hide else ())+self._removed)
+      if self._identifiers is None or self._identifiers[0] != self._plan._version:
+        self._identifiers = (self._plan._version, {})
+      identifier = self._identifiers[1].get(key)
+      if identifier is None:
+        identifier = self._build_identifier(key)
+        self._identifiers[1][key] = identifier
+      if 'list' in style:
+        return list(identifier)
+      return identifier
+
     if not hide:
       hide = []
     identifier = []
@@ -227,6 +279,7 @@ class Setting():
       factors = sorted(factors)
     for factor in factors:
       if factor[0] != '_' and \
+         factor not in self._removed and \
          getattr(self, factor) is not None and \
          factor not in hide:
         if (singleton or factor in self._plan._non_singleton) and \
@@ -246,6 +299,20 @@ class Setting():
         identifier  = hashlib.md5(identifier.encode("utf-8")).hexdigest()
     return identifier
 
+  def _build_identifier(self, key):
+    """builds the identifier of the setting from the identifier layout of the plan."""
+    style, sort, factor_separator, modality_separator, singleton, default, hide = key
+    layout = self._plan._identifier_layout(
+      sort, modality_separator, singleton, default, hide)
+    setting = self._setting
+    identifier = [parts[setting[factor_index]] for factor_index, parts in layout
+                  if parts[setting[factor_index]] is not None]
+    if 'list' not in style:
+      identifier = factor_separator.join(identifier)
+      if style == 'hash':
+        identifier  = hashlib.md5(identifier.encode("utf-8")).hexdigest()
+    return identifier
+
   def replace(self, factor, value=None, positional=0, relative=0):
     """returns a new doce.Plan object with one factor with modified modality.
 
@@ -312,11 +379,12 @@ class Setting():
     # get modality index
     if value is not None:
       factor_name = self._plan.factors()[factor]
-      modalities = self._plan.__getattribute__(factor_name)
-      positional, = np.where(modalities == value)
-      positional = positional[0] # assumes no repetion
+      positional = self._plan._modality_index(factor_name, value)
+      if positional is None:
+        print('Unable to find the requested modality.')
+        return None
 
-    setting = copy.deepcopy(self._setting)
+    setting = list(self._setting)
     if relative:
       setting[factor] += relative
     else:
@@ -342,6 +410,65 @@ class Setting():
 
     doce.Plan.do
 
+    """
+    return int(self._perform(function, experiment, log_file_name, *parameters) == 'failure')
+
+  def _perform(
+    self,
+    function,
+    experiment,
+    log_file_name,
+    *parameters
+    ):
+    """run the function given as parameter for the setting,
+    and returns the outcome: 'success', 'failure' or 'skipped'."""
+    outcome = 'success'
+    with experiment.trace('skip check', 'doce'):
+      skip = experiment.skip_setting(self)
+    if skip:
+      outcome = 'skipped'
+      message = 'Metrics for setting '+self.identifier()+' already available. Skipping...'
+      print(message)
+      if log_file_name:
+        logging.info(message)
+    else:
+      ledger = experiment._ledger
+      if ledger:
+        usage = ledger.start()
+      try:
+        with experiment.trace(self.identifier(), 'step'):
+          function(self, experiment, *parameters)
+      except Exception as exception:
+        if ledger:
+          ledger.record(self, experiment, usage, exception)
+        if log_file_name:
+          outcome = 'failure'
+          logging.info('Failed setting: %s', self.identifier())
+          logging.info(traceback.format_exc())
+        else:
+          print('Failed setting: '+self.identifier())
+          raise exception
+      else:
+        if ledger:
+          ledger.record(self, experiment, usage)
+    return outcome
+
+  async def aperform(
+    self,
+    function,
+    experiment,
+    log_file_name,
+    *parameters
+    ):
+    """await the coroutine function given as parameter for the setting.
+
+  	Helper function for the method :meth:`~doce.Plan.aperform`.
+
+  	See Also
+  	--------
+
+    doce.Plan.aperform
+
     """
     failed = 0
     if experiment.skip_setting(self) :
@@ -350,9 +477,15 @@ class Setting():
       if log_file_name:
         logging.info(message)
     else:
+      ledger = experiment._ledger
+      if ledger:
+        # the thread is shared by concurrent settings, only the wall time is measured
+        usage = ledger.start(concurrent=True)
       try:
-        function(self, experiment, *parameters)
+        await function(self, experiment, *parameters)
       except Exception as exception:
+        if ledger:
+          ledger.record(self, experiment, usage, exception)
         if log_file_name:
           failed = 1
           logging.info('Failed setting: %s', self.identifier())
@@ -360,6 +493,9 @@ class Setting():
         else:
           print('Failed setting: '+self.identifier())
           raise exception
+      else:
+        if ledger:
+          ledger.record(self, experiment, usage)
     return failed
 
   def remove_factor(self, factor):
@@ -372,7 +508,8 @@ class Setting():
       the name of the factor.
 
     """
-    setting_copy = copy.deepcopy(self)
+    setting_copy = Setting(self._plan, self._setting)
+    setting_copy.__dict__.update(self.__dict__)
     delattr(setting_copy, factor)
     return setting_copy
 
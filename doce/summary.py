@@ -0,0 +1,185 @@
+"""Maintain summary statistics of the outputs of the doce module while they are written."""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+class Summary():
+  """Streaming summary statistics of an output: count, mean, M2, min and max.
+
+  The statistics are updated with each chunk of data written or appended to the output,
+  using the parallel update of the mean and of the sum of squared deviations M2,
+  so that the data is never read again. The reductions np.mean, np.std, np.var,
+  np.min, np.amin, np.max and np.amax of the output are then computed from the statistics
+  by :meth:`doce.metric.Metric.reduce`, without reading the output.
+
+  The statistics are maintained by :meth:`doce.experiment.Experiment.save_output`
+  for .npy storage and by :meth:`doce.experiment.Experiment.append_output` for .h5 storage.
+  Only integer and floating point data is summarized.
+
+  The statistics are accumulated in double precision, and cast to the precision of
+  floating point data. As numpy accumulates floating point data in the precision of the data,
+  the reductions of float32 or float16 data may differ from those of numpy in the last digits.
+
+  Examples
+  --------
+
+  >>> import numpy as np
+  >>> import doce
+
+  >>> s = doce.Summary()
+  >>> s.update(np.arange(5))
+  >>> s.update(np.arange(5, 10))
+  >>> print(s.value(np.mean), s.value(np.std), s.value(np.max))
+  4.5 2.8722813232690143 9
+  >>> print(np.mean(np.arange(10)), np.std(np.arange(10)), np.max(np.arange(10)))
+  4.5 2.8722813232690143 9
+  >>> s.value(np.median) is None
+  True
+  """
+
+  def __init__(self, state=None):
+    self.count = 0
+    self.mean = 0.
+    self.m2 = 0.
+    self.minimum = None
+    self.maximum = None
+    self.dtype = None
+    self.valid = True
+    if state:
+      self.count = state['count']
+      self.mean = state['mean']
+      self.m2 = state['m2']
+      self.minimum = state['min']
+      self.maximum = state['max']
+      self.dtype = state['dtype']
+
+  def update(self, data):
+    """updates the statistics with a chunk of data."""
+    data = np.asarray(data)
+    if not (np.issubdtype(data.dtype, np.integer) or np.issubdtype(data.dtype, np.floating)):
+      self.valid = False
+      return
+    count = data.size
+    if not count:
+      return
+    mean = np.mean(data, dtype=np.float64).item()
+    m2 = np.var(data, dtype=np.float64).item()*count
+    minimum = np.min(data).item()
+    maximum = np.max(data).item()
+    if not self.count:
+      (self.mean, self.m2, self.minimum, self.maximum) = (mean, m2, minimum, maximum)
+      self.dtype = data.dtype.str
+    else:
+      total = self.count+count
+      delta = mean-self.mean
+      self.mean += delta*count/total
+      self.m2 += m2+delta**2*self.count*count/total
+      # nan is propagated, as np.min and np.max do
+      self.minimum = np.minimum(self.minimum, minimum).item()
+      self.maximum = np.maximum(self.maximum, maximum).item()
+      self.dtype = np.result_type(np.dtype(self.dtype), data.dtype).str
+    self.count += count
+
+  def state(self):
+    """returns the statistics as a dict, or None if the data is not summarized."""
+    if not self.valid:
+      return None
+    return {'count': self.count, 'mean': self.mean, 'm2': self.m2,
+      'min': self.minimum, 'max': self.maximum, 'dtype': self.dtype}
+
+  def value(self, function):
+    """returns the reduction of the output by function, or None if it is not available from the statistics."""
+    statistic = _statistics().get(function)
+    if statistic is None or not self.valid or not self.count:
+      return None
+    dtype = np.dtype(self.dtype)
+    if statistic in ('min', 'max'):
+      return dtype.type(self.minimum if statistic == 'min' else self.maximum)
+    value = {'mean': self.mean, 'var': self.m2/self.count, 'std': np.sqrt(self.m2/self.count)}[statistic]
+    # the reductions of integer data are computed in double precision, as numpy does,
+    # while those of single or half precision data are cast from double precision
+    return (dtype.type if np.issubdtype(dtype, np.floating) else np.float64)(value)
+
+def supports(function):
+  """returns True if the reduction by function is available from the statistics."""
+  return function in _statistics()
+
+def file_name(output_file_name):
+  """returns the path to the file storing the statistics of an .npy file."""
+  return output_file_name[:-len('.npy')]+'.summary.json'
+
+def save(output_file_name, summary):
+  """stores the statistics of an .npy file, along its size and time of last modification."""
+  state = summary.state()
+  if state is None:
+    return
+  stat = os.stat(output_file_name)
+  state['identity'] = [stat.st_size, stat.st_mtime_ns]
+  temporary_file_name = file_name(output_file_name)+'.tmp'
+  with open(temporary_file_name, 'w') as file:
+    json.dump(state, file)
+  os.replace(temporary_file_name, file_name(output_file_name))
+
+def load(output_file_name):
+  """returns the statistics of an .npy file, or None if not available or outdated,
+  for instance if the file has been written by other means than
+  :meth:`doce.experiment.Experiment.save_output`."""
+  try:
+    with open(file_name(output_file_name)) as file:
+      state = json.load(file)
+    stat = os.stat(output_file_name)
+  except (OSError, ValueError):
+    return None
+  if state.get('identity') != [stat.st_size, stat.st_mtime_ns]:
+    return None
+  return (Summary(state), stat.st_mtime, (stat.st_size, stat.st_mtime_ns))
+
+def save_h5(node, summary):
+  """stores the statistics of an array of an .h5 file as its attribute doce_summary,
+  along a stamp of its content, see :func:`stamp`."""
+  state = summary.state()
+  if state is None:
+    if 'doce_summary' in node._v_attrs:
+      del node._v_attrs.doce_summary
+    return
+  state['stamp'] = stamp(node)
+  node._v_attrs.doce_summary = state
+
+def load_h5(node):
+  """returns the statistics of an array of an .h5 file, or None if not available or outdated,
+  for instance if the array has been resized or rewritten by other means than
+  :meth:`doce.experiment.Experiment.append_output`."""
+  if 'doce_summary' not in node._v_attrs:
+    return None
+  state = node._v_attrs.doce_summary
+  if state['count'] != np.prod(node.shape) or state.get('stamp') != stamp(node):
+    return None
+  return Summary(state)
+
+def stamp(node, samples=16):
+  """returns a digest of the shape of an array of an .h5 file and of some of its rows.
+
+  The rows are sampled evenly, including the first and the last ones, so that
+  the digest is computed without reading the array, and changes if the array is
+  rewritten in place, but not necessarily if a few elements are modified.
+  """
+  digest = hashlib.sha1(repr(node.shape).encode())
+  if not node.shape:
+    digest.update(np.ascontiguousarray(node.read()).tobytes())
+  elif node.shape[0]:
+    for row in np.unique(np.linspace(0, node.shape[0]-1, samples+1).astype(int)):
+      digest.update(np.ascontiguousarray(node[row:row+1]).tobytes())
+  return digest.hexdigest()
+
+def _statistics():
+  return {
+    np.mean: 'mean',
+    np.std: 'std',
+    np.var: 'var',
+    np.min: 'min',
+    np.amin: 'min',
+    np.max: 'max',
+    np.amax: 'max'
+    }
@@ -0,0 +1,102 @@
+"""Record the timeline of the computation of the settings of the doce module."""
+
+import os
+import json
+import time
+import threading
+import contextlib
+import doce.util as eu
+
+class Tracer():
+  """Records the timeline of the computation in the Chrome trace event format.
+
+  Each span of the computation, for instance the step of a setting,
+  the check for already available outputs, a storage write or a reduction,
+  is recorded as a complete event with the process and the thread
+  that computed it, so that each worker has its own track.
+  The events are appended to a buffer file and the trace is written to
+  the file file_name by :meth:`doce.tracer.Tracer.export`.
+  The trace can be viewed with chrome://tracing or https://ui.perfetto.dev.
+
+  The tracer of an experiment is set using :meth:`doce.experiment.Experiment.set_trace`,
+  and the trace is exported at the end of :meth:`doce.Plan.perform`.
+
+  Examples
+  --------
+
+  >>> import json
+  >>> import time
+  >>> import doce
+
+  >>> e = doce.Experiment()
+  >>> e.add_plan('plan', n=[1, 2])
+  >>> e.set_trace('/tmp/trace.json')
+  >>> def step(setting, experiment):
+  ...   time.sleep(setting.n/100)
+  ...   with experiment.trace('save', 'storage'):
+  ...     time.sleep(0.001)
+  >>> e.perform([], step, progress='')
+  0
+  >>> with open('/tmp/trace.json') as file:
+  ...   trace = json.load(file)
+  >>> [(event['name'], event['cat']) for event in trace['traceEvents'] if event['ph'] == 'X']
+  [('skip check', 'doce'), ('save', 'storage'), ('n=1', 'step'), ('skip check', 'doce'), ('save', 'storage'), ('n=2', 'step')]
+  """
+
+  def __init__(self, file_name):
+    self.file_name = file_name
+
+  @contextlib.contextmanager
+  def span(self, name, category='user', **args):
+    """records the span of the code run within the context as a complete event.
+
+    If an exception is raised, its type is stored in the arguments of the event.
+    """
+    start = time.time()
+    try:
+      yield
+    except BaseException as exception:
+      args['exception'] = type(exception).__name__
+      raise
+    finally:
+      self.event(name, category, start, time.time(), **args)
+
+  def event(self, name, category, start, stop, **args):
+    """appends a complete event spanning from start to stop, in seconds since the epoch."""
+    event = {
+      'name': name,
+      'cat': category,
+      'ph': 'X',
+      'ts': start*1e6,
+      'dur': (stop-start)*1e6,
+      'pid': os.getpid(),
+      'tid': threading.get_native_id(),
+      'args': args
+      }
+    eu.append_json_line(self._events_file_name(), event)
+
+  def events(self):
+    """returns the list of the recorded events, skipping the unreadable ones with a warning."""
+    return eu.read_json_lines(self._events_file_name())
+
+  def clear(self):
+    """removes the recorded events."""
+    if os.path.exists(self._events_file_name()):
+      os.remove(self._events_file_name())
+
+  def export(self):
+    """writes the recorded events in the trace event format to the file file_name."""
+    events = self.events()
+    tracks = sorted({(event['pid'], event['tid']) for event in events})
+    metadata = []
+    for pid in sorted({pid for pid, _ in tracks}):
+      metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+        'args': {'name': f'process {pid}'}})
+    for worker, (pid, tid) in enumerate(tracks):
+      metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+        'args': {'name': f'worker {worker}'}})
+    with open(self.file_name, 'w') as file:
+      json.dump({'traceEvents': metadata+events, 'displayTimeUnit': 'ms'}, file)
+
+  def _events_file_name(self):
+    return self.file_name+'.events'
@@ -1,7 +1,13 @@
 """Handle low level functionalities of the doce module."""
 
+import os
 import sys
 import re
+import json
+import threading
+import warnings
+
+_append_lock = threading.Lock()
 
 def special_caracter_natural_naming(modality):
   modifier = {' ': 'space',
@@ -311,6 +317,53 @@ def in_notebook():
   except NameError:
     return False
 
+def append_json_line(file_name, record):
+  """append a record to a JSON lines file, in a single write.
+
+  Appends from the threads of a process are serialized. Appends from different
+  processes are only guaranteed not to interleave on local POSIX file systems,
+  where files opened for appending are written at their end by each write.
+  On network file systems such as NFS or on Windows, lines may be torn or interleaved,
+  and are then skipped by :func:`doce.util.read_json_lines`.
+  """
+  line = json.dumps(record)+'\n'
+  with _append_lock:
+    with open(file_name, 'a') as file:
+      file.write(line)
+
+def read_json_lines(file_name):
+  r"""return the records of a JSON lines file, or an empty list if the file does not exist.
+
+  The lines that cannot be parsed, for instance torn by concurrent appends,
+  are skipped with a warning.
+
+  Examples
+  --------
+
+  >>> import warnings
+  >>> import doce
+  >>> with open('/tmp/records.jsonl', 'w') as file:
+  ...   _ = file.write('{"n": 1}\n{"n": \n{"n": 2}\n')
+  >>> with warnings.catch_warnings(record=True) as caught:
+  ...   warnings.simplefilter('always')
+  ...   records = doce.util.read_json_lines('/tmp/records.jsonl')
+  >>> records, str(caught[0].message)
+  ([{'n': 1}, {'n': 2}], '1 unreadable line skipped in /tmp/records.jsonl.')
+  """
+  records = []
+  nb_skipped = 0
+  if os.path.exists(file_name):
+    with open(file_name) as file:
+      for line in file:
+        if line.strip():
+          try:
+            records.append(json.loads(line))
+          except ValueError:
+            nb_skipped += 1
+  if nb_skipped:
+    warnings.warn(f'{nb_skipped} unreadable line{"s" if nb_skipped > 1 else ""} skipped in {file_name}.')
+  return records
+
 if __name__ == '__main__':
   import doctest
   doctest.testmod(optionflags=doctest.ELLIPSIS | doctest.NORMALIZE_WHITESPACE)
@@ -34,7 +34,7 @@ setup(
     license='ASL',
     install_requires=[
         'argunparse',
-        'joblib',
+        'joblib>=1.4',
         'numpy',
         'pandas',
         'scipy',